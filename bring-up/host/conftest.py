@@ -0,0 +1,25 @@
+# Run the bring-up code on the host, with the stand-ins in this directory
+# for the MicroPython modules and the Tiny Tapeout demo board
+
+import os
+import sys
+import time
+import builtins
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, HOST_DIR)
+sys.path.insert(0, os.path.dirname(HOST_DIR))
+
+import micropython
+
+# Builtin in MicroPython, used as decorator without import
+builtins.micropython = micropython
+
+# MicroPython additions to the time module
+time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+time.sleep_us = lambda us: time.sleep(us / 1_000_000)
+time.ticks_ms = lambda: time.perf_counter_ns() // 1_000_000
+time.ticks_us = lambda: time.perf_counter_ns() // 1_000
+time.ticks_diff = lambda new, old: new - old
+time.ticks_add = lambda ticks, delta: ticks + delta
@@ -0,0 +1,36 @@
+# Simulated frame pulses of the design on a pin, with a virtual clock in us
+
+import micropython
+
+# 800 x 525 clock cycles at 25.175 MHz
+FRAME_US = 16683
+
+class FramePulses:
+    """Pulse a pin once per frame, like next_frame
+
+    ticks_us() is the virtual clock, to replace time.ticks_us. After each pulse,
+    the clock advances by the given latency and the scheduled functions
+    run. Pulses in skip are not followed by the scheduled functions,
+    as if the CPU was busy for a whole frame.
+    """
+
+    def __init__(self, pin, frame_us=FRAME_US):
+        self.pin = pin
+        self.frame_us = frame_us
+        self.now = 0
+
+    def ticks_us(self):
+        return self.now
+
+    def run(self, frames, latency_us=50, skip=()):
+        for frame in range(frames):
+            start = self.now
+
+            self.pin.drive(1)
+            self.pin.drive(0)
+
+            if frame not in skip:
+                self.now += latency_us
+                micropython.run_scheduled()
+
+            self.now = start + self.frame_us
@@ -0,0 +1,51 @@
+# Host stand-in for the MicroPython machine module, only what the bring-up code uses
+
+class Pin:
+    IN = 0
+    OUT = 1
+
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+
+    def __init__(self, id=None, mode=IN, value=None):
+        self.id = id
+        self.mode = mode
+
+        # Set source to a callable to drive an input from the test
+        self.source = None
+        self.level = value or 0
+
+        self.handler = None
+        self.trigger = 0
+
+    def init(self, mode=IN, value=None):
+        self.mode = mode
+        if value is not None:
+            self.level = value
+
+    def value(self, level=None):
+        if level is None:
+            return self.source() if self.source else self.level
+        self.level = level
+
+    __call__ = value
+
+    def irq(self, handler=None, trigger=IRQ_RISING, hard=False):
+        self.handler = handler
+        self.trigger = trigger
+
+    def drive(self, level):
+        """Host only, drive an input and call the handler on a matching edge"""
+        edge = self.IRQ_RISING if level and not self.level else self.IRQ_FALLING if self.level and not level else 0
+        self.level = level
+
+        if self.handler and edge & self.trigger:
+            self.handler(self)
+
+class SoftSPI:
+
+    def __init__(self, *args, **kwargs):
+        self.written = bytearray()
+
+    def write(self, data):
+        self.written += bytes(data)
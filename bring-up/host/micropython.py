@@ -0,0 +1,29 @@
+# Host stand-in for the MicroPython micropython module
+
+def native(func):
+    return func
+
+def viper(func):
+    return func
+
+def const(value):
+    return value
+
+# Same depth as the default MICROPY_SCHEDULER_DEPTH
+SCHEDULER_DEPTH = 4
+
+scheduled = []
+
+def schedule(func, arg):
+    if len(scheduled) >= SCHEDULER_DEPTH:
+        raise RuntimeError('schedule queue full')
+    scheduled.append((func, arg))
+
+def run_scheduled():
+    """Host only, run the scheduled functions as the VM does between bytecodes"""
+    while scheduled:
+        func, arg = scheduled.pop(0)
+        func(arg)
+
+def kbd_intr(chr):
+    pass
@@ -0,0 +1,208 @@
+# Host stand-in for the MicroPython rp2 module
+#
+# asm_pio assembles the program into a list of instructions, so that the
+# cycles of a program are known. The StateMachine does not execute the
+# program, it counts the FIFO operations and the cycles they take.
+
+import types
+
+class PIO:
+    OUT_LOW = 0
+    OUT_HIGH = 1
+    IN_LOW = 0
+    IN_HIGH = 1
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+
+class Instruction:
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.delay_cycles = 0
+        self.side_value = None
+
+    def side(self, value):
+        self.side_value = value
+        return self
+
+    def delay(self, cycles):
+        self.delay_cycles = cycles
+        return self
+
+    @property
+    def cycles(self):
+        return 1 + self.delay_cycles
+
+class Program:
+
+    def __init__(self, name, instructions, settings):
+        self.name = name
+        self.instructions = instructions
+        self.settings = settings
+
+    @property
+    def cycles(self):
+        """Cycles of one pass through the program"""
+        return sum(instruction.cycles for instruction in self.instructions)
+
+MNEMONICS = ('out', 'in_', 'pull', 'push', 'set', 'jmp', 'wait', 'nop', 'mov', 'irq')
+OPERANDS = ('pins', 'pindirs', 'x', 'y', 'osr', 'isr', 'null', 'pc', 'exec',
+            'ifempty', 'iffull', 'block', 'noblock', 'not_x', 'not_y', 'x_dec', 'y_dec',
+            'x_not_y', 'pin', 'not_osre', 'gpio', 'rel', 'clear')
+
+def asm_pio(**settings):
+    def assemble(func):
+        instructions = []
+
+        def emit(name):
+            def instruction(*args):
+                instructions.append(Instruction(name, args))
+                return instructions[-1]
+            return instruction
+
+        names = {name: emit(name) for name in MNEMONICS}
+        names.update({name: name for name in OPERANDS})
+        names['wrap_target'] = names['wrap'] = names['label'] = lambda *args: None
+
+        types.FunctionType(func.__code__, dict(func.__globals__, **names))()
+
+        return Program(func.__name__, instructions, settings)
+
+    return assemble
+
+class StateMachine:
+    """State machine that completes each word as soon as it is put
+
+    Counts the calls of put() and get(), the words written into the
+    TX FIFO by the CPU or by DMA, and the state machine cycles to shift
+    them out, assuming one pass through the program per bit. With
+    autopush, each word pushes a word read from the rx callable.
+    """
+
+    instances = {}
+
+    def __init__(self, id, program, freq=125_000_000, **pins):
+        self.id = id
+        self.program = program
+        self.freq = freq
+        self.pins = pins
+        self.running = False
+
+        self.words = []
+        self.received = []
+
+        self.puts = 0
+        self.gets = 0
+        self.dma_words = 0
+        self.cycles = 0
+
+        self.rx = lambda: 0
+
+        StateMachine.instances[id] = self
+
+    def active(self, value=None):
+        if value is None:
+            return self.running
+        self.running = bool(value)
+
+    def write_fifo(self, word):
+        assert self.running, 'state machine is not active'
+
+        self.words.append(word & 0xFFFFFFFF)
+        self.cycles += self.program.settings.get('pull_thresh', 32) * self.program.cycles
+
+        if self.program.settings.get('autopush', False):
+            self.received.append(self.rx())
+
+    def put(self, value, shift=0):
+        self.puts += 1
+
+        values = value if isinstance(value, (bytes, bytearray, memoryview, list)) else [value]
+
+        for value in values:
+            self.write_fifo(value << shift)
+
+    def get(self, buf=None, shift=0):
+        self.gets += 1
+
+        assert self.received, 'get() would block forever'
+        return self.received.pop(0) >> shift
+
+    def tx_fifo(self):
+        return 0
+
+    def rx_fifo(self):
+        return len(self.received)
+
+    @property
+    def fifo_operations(self):
+        """put() and get() calls of the CPU"""
+        return self.puts + self.gets
+
+    @property
+    def time_us(self):
+        """Time to shift out all words so far"""
+        return self.cycles * 1_000_000 / self.freq
+
+# TX FIFO addresses of the state machines, same as the RP2040
+PIO_BASE = (0x50200000, 0x50300000)
+PIO_TXF0 = 0x010
+
+class DMA:
+    """DMA channel that writes into a TX FIFO, completes on trigger
+
+    Counts the claimed channels that were not released with close().
+    """
+
+    claimed = 0
+
+    def __init__(self):
+        self.transfers = 0
+        self.config_args = None
+        self.closed = False
+
+        DMA.claimed += 1
+
+    def pack_ctrl(self, default=None, **fields):
+        ctrl = {'size': 2, 'inc_read': True, 'inc_write': True}
+        ctrl.update(fields)
+        return ctrl
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        assert not self.closed, 'channel was released'
+        self.config_args = (read, write, count, ctrl)
+        if trigger:
+            self.active(1)
+
+    def active(self, value=None):
+        if value is None:
+            return False
+        if value:
+            self.run()
+
+    def run(self):
+        read, write, count, ctrl = self.config_args
+
+        assert not ctrl['inc_write'], 'a FIFO has a single address'
+
+        pio = PIO_BASE.index(write & ~0xFFFFF)
+        sm = StateMachine.instances[pio * 4 + (write - PIO_BASE[pio] - PIO_TXF0) // 4]
+
+        data = memoryview(read).cast('B')
+        size = 1 << ctrl['size']
+
+        for i in range(count):
+            value = int.from_bytes(data[i * size:(i + 1) * size], 'little')
+
+            # Narrow writes are replicated to all byte lanes
+            sm.write_fifo(value * (0x01010101 if size == 1 else 0x00010001 if size == 2 else 1))
+            sm.dma_words += 1
+
+        self.transfers += 1
+
+    def close(self):
+        assert not self.closed, 'channel already released'
+        self.closed = True
+
+        DMA.claimed -= 1
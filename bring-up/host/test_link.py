@@ -0,0 +1,125 @@
+import os
+import sys
+import tty
+import time
+import threading
+
+import pytest
+
+from ttboard.demoboard import DemoBoard
+
+from tt_um_tiny_shader_mole99 import tt_um_tiny_shader_mole99 as bringup
+
+SW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../sw')
+sys.path.append(SW_DIR)
+
+import shaderlink
+from assembler import Program
+
+@pytest.fixture
+def board():
+    """Board side of a pty pair with a LinkServer in a thread"""
+    host_fd, board_fd = os.openpty()
+    tty.setraw(host_fd)
+    tty.setraw(board_fd)
+
+    tt = DemoBoard()
+    spi = bringup.create_spi(tt)
+
+    rx = os.fdopen(board_fd, 'rb', buffering=0)
+    tx = os.fdopen(os.dup(board_fd), 'wb', buffering=0)
+
+    server = bringup.LinkServer(tt, spi, rx, tx)
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+
+    link = shaderlink.ShaderLink(os.fdopen(host_fd, 'rb', buffering=0), os.fdopen(os.dup(host_fd), 'wb', buffering=0))
+
+    yield link, server, spi
+
+    link.exit()
+    thread.join(timeout=1)
+    assert not thread.is_alive()
+
+def uploaded(spi):
+    return bytes(word >> 24 for word in spi._sm.words)
+
+def test_shader(board):
+    link, server, spi = board
+
+    link.connect()
+
+    words = Program.from_file(os.path.join(SW_DIR, 'binary/test7.bit')).words
+    latency = link.shader(words)
+
+    assert uploaded(spi) == bytes(words)
+    assert latency >= 0
+
+def test_pipelined(board):
+    link, server, spi = board
+
+    programs = [Program.from_file(os.path.join(SW_DIR, f'binary/test{i}.bit')).words for i in range(1, 13)]
+
+    for words in programs:
+        link.send(shaderlink.SHADER, bytes(words))
+        assert len(link.pending) <= link.window
+
+    link.user(63)
+    link.flush()
+
+    assert uploaded(spi) == b''.join(bytes(words) for words in programs) + bytes([63])
+
+def test_errors(board):
+    link, server, spi = board
+
+    with pytest.raises(shaderlink.LinkError, match='bad length'):
+        link.request(shaderlink.SHADER, b'\x40' * 3)
+
+    with pytest.raises(shaderlink.LinkError, match='unknown type'):
+        link.request(0x7E)
+
+    # A corrupted frame is answered with bad crc
+    frame = bytearray(shaderlink.encode(shaderlink.USER, link.seq, b'\x01'))
+    frame[-1] ^= 0xFF
+    link.tx.write(bytes(frame))
+    link.pending.append((link.seq, shaderlink.USER))
+    link.seq += 1
+
+    with pytest.raises(shaderlink.LinkError, match='bad crc'):
+        link.flush()
+
+    # Still in sync after the errors
+    link.connect()
+    assert uploaded(spi) == b''
+
+def test_noise_before_frame(board):
+    link, server, spi = board
+
+    # The REPL echoes the command that started the link
+    link.tx.write(b'"link"\r\n')
+    link.connect()
+
+def test_playlist(board):
+    link, server, spi = board
+
+    entries = [(0, [i] * 10) for i in range(30)]
+    link.playlist(entries)
+
+    # Split into frames, the first one clears and the last one starts playing
+    assert len(server.playlist) == 30
+    assert [duration for duration, shader in server.playlist] == [0] * 30
+
+    # Zero durations play out while waiting for the next request
+    for i in range(100):
+        if not server.playing:
+            break
+        time.sleep(0.01)
+
+    assert uploaded(spi) == b''.join(bytes(words) for duration, words in entries)
+    assert not server.playing
+
+def test_playlist_frames():
+    payloads = shaderlink.playlist_frames([(1000, [0x40] * 10)] * 50, loop=True)
+
+    assert [payload[0] for payload in payloads] == [shaderlink.CLEAR, 0, shaderlink.PLAY | shaderlink.LOOP]
+    assert all(len(payload) <= shaderlink.MAX_PAYLOAD for payload in payloads)
@@ -0,0 +1,80 @@
+import pytest
+
+import rp2
+from machine import Pin
+
+from tt_um_tiny_shader_mole99.pio_spi import PIOSPI
+
+DATA = bytes(range(0x40, 0x4A))
+
+def create_spi(**kwargs):
+    return PIOSPI(sm_id=0, pin_mosi=Pin(1), pin_miso=Pin(2), pin_sck=Pin(3), cpha=True, cpol=False, freq=int(5e6), **kwargs)
+
+@pytest.mark.parametrize('kwargs', [{}, {'write_only': True}, {'write_only': True, 'dma': True}])
+def test_write(kwargs):
+    spi = create_spi(**kwargs)
+    spi.write(DATA)
+
+    # The byte is in the upper 8 bits, shifted out MSB first
+    assert bytes(word >> 24 for word in spi._sm.words) == DATA
+    assert spi._sm.time_us == pytest.approx(len(DATA) * 8 / 5)
+
+def test_fifo_operations():
+    loop = create_spi()
+    loop.write(DATA)
+
+    bulk = create_spi(write_only=True)
+    bulk.write(DATA)
+
+    dma = create_spi(write_only=True, dma=True)
+    dma.write(DATA)
+
+    # The loop puts and drains each byte, the bulk write puts the buffer at once
+    assert loop._sm.fifo_operations == 2 * len(DATA)
+    assert bulk._sm.fifo_operations == 1
+    assert dma._sm.fifo_operations == 0
+    assert dma._sm.dma_words == len(DATA)
+
+    # The shift time on the bus stays the same
+    assert loop._sm.cycles == bulk._sm.cycles == dma._sm.cycles
+
+def test_write_only_programs():
+    for cpha in (False, True):
+        spi = PIOSPI(sm_id=0, pin_mosi=Pin(1), pin_miso=Pin(2), pin_sck=Pin(3), cpha=cpha, write_only=True)
+
+        settings = spi._sm.program.settings
+        assert not settings.get('autopush', False)
+        assert all(instruction.name != 'in_' for instruction in spi._sm.program.instructions)
+
+        spi.write(DATA)
+        assert spi._sm.rx_fifo() == 0
+
+def test_deinit():
+    claimed = rp2.DMA.claimed
+
+    spi = create_spi(write_only=True, dma=True)
+    assert rp2.DMA.claimed == claimed + 1
+
+    # Released by deinit, claimed again by init
+    spi.deinit()
+    assert rp2.DMA.claimed == claimed
+    assert not spi._sm.active()
+
+    spi.init()
+    assert rp2.DMA.claimed == claimed + 1
+
+    spi.write(DATA)
+    assert bytes(word >> 24 for word in spi._sm.words) == DATA
+
+    spi.deinit()
+    assert rp2.DMA.claimed == claimed
+
+def test_write_only_read():
+    spi = create_spi(write_only=True)
+
+    with pytest.raises(OSError):
+        spi.read(4)
+    with pytest.raises(OSError):
+        spi.readinto(bytearray(4))
+    with pytest.raises(OSError):
+        spi.write_read_blocking(DATA)
@@ -0,0 +1,156 @@
+import time
+
+import pytest
+
+import micropython
+from frames import FramePulses
+from ttboard.demoboard import DemoBoard
+
+from tt_um_tiny_shader_mole99 import tt_um_tiny_shader_mole99 as bringup
+
+@pytest.fixture
+def tt():
+    return DemoBoard()
+
+@pytest.fixture
+def pulses(tt, monkeypatch):
+    pulses = FramePulses(tt.pins.pin_uio5)
+    monkeypatch.setattr(time, 'ticks_us', pulses.ticks_us)
+    micropython.scheduled.clear()
+    return pulses
+
+def committed(spi):
+    return [word >> 24 for word in spi._sm.words]
+
+def test_one_value_per_frame(tt, pulses):
+    spi = bringup.create_spi(tt)
+    scheduler = bringup.UserScheduler(tt, spi, range(10))
+    scheduler.start()
+
+    pulses.run(12)
+
+    assert committed(spi) == list(range(10))
+    assert scheduler.done
+    assert scheduler.missed == 0
+
+    # Each value is sent in command mode
+    assert tt.events[:3] == [('ui_in', 0, 0), ('uio_in', 0, 0), ('uio_in', 0, 1)]
+
+def test_late_commit(tt, pulses):
+    spi = bringup.create_spi(tt)
+    scheduler = bringup.UserScheduler(tt, spi, [1, 2, 3])
+    scheduler.start()
+
+    # Too late for the vertical blanking, the value is kept for the next frame
+    pulses.run(1, latency_us=bringup.COMMIT_US + 1)
+    assert committed(spi) == []
+    assert scheduler.missed == 1
+
+    pulses.run(3)
+    assert committed(spi) == [1, 2, 3]
+    assert scheduler.missed == 1
+
+def test_busy_frames(tt, pulses):
+    spi = bringup.create_spi(tt)
+    scheduler = bringup.UserScheduler(tt, spi, range(5))
+    scheduler.start()
+
+    # The commits of frames 1 and 2 are pending when frame 3 starts
+    pulses.run(6, skip=(1, 2))
+
+    assert committed(spi) == [0, 1, 2, 3]
+    assert scheduler.missed == 2
+
+def test_queue_full(tt, pulses):
+    spi = bringup.create_spi(tt)
+    scheduler = bringup.UserScheduler(tt, spi, range(3))
+    scheduler.start()
+
+    # The pulse is dropped while the queue is full of other work
+    for i in range(micropython.SCHEDULER_DEPTH):
+        micropython.schedule(lambda arg: None, None)
+
+    pulses.run(1, skip=(0,))
+    micropython.run_scheduled()
+
+    pulses.run(2)
+
+    assert committed(spi) == [0, 1]
+    assert scheduler.missed == 1
+
+def test_stop(tt, pulses):
+    spi = bringup.create_spi(tt)
+    scheduler = bringup.UserScheduler(tt, spi, range(3))
+    scheduler.start()
+    scheduler.stop()
+
+    pulses.run(3)
+
+    assert committed(spi) == []
+
+def uploads(spi):
+    """Uploaded shaders, 10 words each"""
+    words = committed(spi)
+    return [bytes(words[i:i + 10]) for i in range(0, len(words), 10)]
+
+# Buffers as in the shader pack, DMA needs the buffer protocol
+SHADER_A = bytes([0x01] * 10)
+SHADER_B = bytes([0x02] * 10)
+
+def test_duration_frames():
+    assert bringup.duration_frames(1000) == 60
+    assert bringup.duration_frames(50) == 3
+    assert bringup.duration_frames(0) == 1
+
+def test_player(tt, pulses):
+    spi = bringup.create_spi(tt)
+    player = bringup.ShaderPlayer(tt, spi, [(SHADER_A, 50), (SHADER_B, 100)])
+    player.start()
+
+    pulses.run(20)
+
+    # Switches in the vertical blanking after frames 1 and 4, done after 6 more frames
+    assert uploads(spi) == [SHADER_A, SHADER_B]
+    assert player.switches == [1, 4]
+    assert player.done
+    assert player.missed == 0
+
+    # No reset and the clock keeps running
+    assert ('reset_project', True) not in tt.events
+    assert ('clock_project_stop',) not in tt.events
+
+def test_player_loop(tt, pulses):
+    spi = bringup.create_spi(tt)
+    player = bringup.ShaderPlayer(tt, spi, [(SHADER_A, 50), (SHADER_B, 50)], loop=True)
+    player.start()
+
+    pulses.run(12)
+
+    assert player.switches == [1, 4, 7, 10]
+    assert uploads(spi) == [SHADER_A, SHADER_B] * 2
+    assert not player.done
+
+def test_player_late(tt, pulses):
+    spi = bringup.create_spi(tt)
+    player = bringup.ShaderPlayer(tt, spi, [(SHADER_A, 50), (SHADER_B, 50)])
+    player.start()
+
+    pulses.run(3)
+
+    # The switch is due after frame 4, but too late for its blanking
+    pulses.run(1, latency_us=bringup.COMMIT_US + 1)
+    pulses.run(1)
+
+    assert player.switches == [1, 5]
+    assert player.missed == 1
+
+def test_player_busy(tt, pulses):
+    spi = bringup.create_spi(tt)
+    player = bringup.ShaderPlayer(tt, spi, [(SHADER_A, 50), (SHADER_B, 50)])
+    player.start()
+
+    # Busy through frames 4 and 5, the switch happens in frame 6
+    pulses.run(6, skip=(3, 4))
+
+    assert player.switches == [1, 6]
+    assert player.missed == 2
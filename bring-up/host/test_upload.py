@@ -0,0 +1,47 @@
+import pytest
+
+from ttboard.demoboard import DemoBoard
+
+from tt_um_tiny_shader_mole99 import tt_um_tiny_shader_mole99 as bringup
+
+def vsync_after(reads):
+    """vsync source that goes low after the given number of reads"""
+    levels = iter([1] * reads)
+    return lambda: next(levels, 0)
+
+@pytest.fixture
+def tt():
+    return DemoBoard()
+
+def test_load_shader(tt):
+    tt.pins.pin_uo_out3.source = vsync_after(5)
+
+    spi = bringup.create_spi(tt)
+    shader = bringup.shaders['test7']
+
+    latency = bringup.load_shader(tt, spi, shader)
+
+    # MSB first, one word per byte
+    assert [word >> 24 for word in spi._sm.words] == list(shader)
+    assert latency >= 0
+
+    # Data mode, CS low during the transfer, the clock is never touched
+    assert tt.events == [('ui_in', 0, 1), ('uio_in', 0, 0), ('uio_in', 0, 1)]
+
+def test_upload_time(tt):
+    tt.pins.pin_uo_out3.source = vsync_after(0)
+
+    spi = bringup.create_spi(tt)
+    bringup.load_shader(tt, spi, bringup.shaders['test1'])
+
+    # 10 bytes at 5 MHz, well within the vertical back porch
+    assert spi._sm.time_us == pytest.approx(16)
+
+def test_wait_vsync(tt):
+    reads = []
+    source = vsync_after(100)
+    tt.pins.pin_uo_out3.source = lambda: reads.append(1) or source()
+
+    bringup.wait_vsync(tt)
+
+    assert len(reads) == 101
@@ -0,0 +1,93 @@
+# Host stand-in for ttboard.demoboard, records what the bring-up code does to the board
+
+from machine import Pin
+
+class Pins:
+    OUT = Pin.OUT
+    IN = Pin.IN
+
+    def __init__(self):
+        for i in range(8):
+            setattr(self, f'pin_ui_in{i}', Pin(f'ui_in{i}'))
+            setattr(self, f'pin_uo_out{i}', Pin(f'uo_out{i}'))
+            setattr(self, f'pin_uio{i}', Pin(f'uio{i}'))
+
+        self.rp_projclk = Pin('rp_projclk', Pin.OUT)
+
+class Port:
+    """Indexed access to eight pins, writes are recorded in the board events"""
+
+    def __init__(self, board, name, pins):
+        self.board = board
+        self.name = name
+        self.pins = pins
+
+    def __getitem__(self, index):
+        return self.pins[index].value()
+
+    def __setitem__(self, index, value):
+        self.pins[index].value(value)
+        self.board.events.append((self.name, index, value))
+
+    @property
+    def value(self):
+        return sum(pin.value() << i for i, pin in enumerate(self.pins))
+
+    @value.setter
+    def value(self, value):
+        for i, pin in enumerate(self.pins):
+            pin.value(value >> i & 1)
+        self.board.events.append((self.name, None, value))
+
+class Project:
+
+    def __init__(self, board):
+        self.board = board
+
+    def enable(self):
+        self.board.events.append(('enable',))
+
+class Shuttle:
+
+    def __init__(self, board, projects):
+        self.projects = {name: Project(board) for name in projects}
+
+    def has(self, name):
+        return name in self.projects
+
+    def __getattr__(self, name):
+        return self.projects[name]
+
+class DemoBoard:
+
+    _instance = None
+
+    def __init__(self, projects=('tt_um_tiny_shader_mole99',)):
+        self.events = []
+        self.pins = Pins()
+        self.shuttle = Shuttle(self, projects)
+
+        self.ui_in = Port(self, 'ui_in', [getattr(self.pins, f'pin_ui_in{i}') for i in range(8)])
+        self.uo_out = Port(self, 'uo_out', [getattr(self.pins, f'pin_uo_out{i}') for i in range(8)])
+        self.uio_in = Port(self, 'uio_in', [getattr(self.pins, f'pin_uio{i}') for i in range(8)])
+        self.uio_oe_pico = Port(self, 'uio_oe_pico', [Pin() for i in range(8)])
+
+        self.clk = self.pins.rp_projclk
+        self.clock_hz = 0
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def clock_project_stop(self):
+        self.clock_hz = 0
+        self.events.append(('clock_project_stop',))
+
+    def clock_project_PWM(self, freq):
+        self.clock_hz = freq
+        self.events.append(('clock_project_PWM', freq))
+
+    def reset_project(self, reset):
+        self.events.append(('reset_project', reset))
@@ -0,0 +1,53 @@
+# Framed binary protocol for MicroPython, see sw/shaderlink.py for the format
+
+SYNC = 0xA5
+
+PING = 0x01
+SHADER = 0x02
+USER = 0x03
+PLAYLIST = 0x04
+STOP = 0x05
+EXIT = 0x06
+
+RESPONSE = 0x80
+
+CLEAR = 0x01
+PLAY = 0x02
+LOOP = 0x04
+
+OK = 0
+BAD_CRC = 1
+BAD_LENGTH = 2
+BAD_TYPE = 3
+
+ENTRY_SIZE = 2
+
+def crc8(data, crc=0):
+    for byte in data:
+        crc ^= byte
+        for i in range(8):
+            crc = (crc << 1 ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+    return crc
+
+def encode(frame_type, seq, payload=b''):
+    body = bytes([frame_type, seq, len(payload)]) + bytes(payload)
+    return bytes([SYNC]) + body + bytes([crc8(body)])
+
+def read_exactly(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if chunk:
+            data += chunk
+    return data
+
+def read_frame(stream):
+    """Read the next frame, returns (type, seq, payload, crc_ok)"""
+    while read_exactly(stream, 1)[0] != SYNC:
+        pass
+
+    header = read_exactly(stream, 3)
+    payload = read_exactly(stream, header[2])
+    crc = read_exactly(stream, 1)[0]
+
+    return header[0], header[1], payload, crc == crc8(header + payload)
@@ -1,5 +1,6 @@
 # SPI using PIO, which is handy because you can use any pins.
 
+import time
 import rp2
 from machine import Pin
 
@@ -14,18 +15,106 @@ def spi_cpha1():
     out(pins, 1)             .side(0x1).delay(1)
     in_(pins, 1)             .side(0x0)
     
+# Write-only versions, MISO is not sampled and nothing is pushed into the RX FIFO
+# SCK stays low while the state machine stalls for the next byte
+
+@rp2.asm_pio(out_shiftdir=0, autopull=True, pull_thresh=8, sideset_init=(rp2.PIO.OUT_LOW,), out_init=rp2.PIO.OUT_LOW)
+def spi_cpha0_write():
+    out(pins, 1)             .side(0x0)
+    nop()                    .side(0x1)
+
+@rp2.asm_pio(out_shiftdir=0, autopull=True, pull_thresh=8, sideset_init=(rp2.PIO.OUT_LOW,), out_init=rp2.PIO.OUT_LOW)
+def spi_cpha1_write():
+    pull(ifempty)            .side(0x0)
+    out(pins, 1)             .side(0x1).delay(1)
+    nop()                    .side(0x0)
+
+# TX FIFO addresses and DMA requests of the state machines, sm_id 0-3 on PIO0, 4-7 on PIO1
+PIO_BASE = (0x50200000, 0x50300000)
+PIO_TXF0 = 0x010
+DREQ_PIO_TX0 = (0, 8)
+
 class PIOSPI:
 
-    def __init__(self, sm_id, pin_mosi, pin_miso, pin_sck, cpha=False, cpol=False, freq=1000000):
+    def __init__(self, sm_id, pin_mosi, pin_miso, pin_sck, cpha=False, cpol=False, freq=1000000, write_only=False, dma=False):
         assert(not(cpol))
         if not cpha:
-            self._sm = rp2.StateMachine(sm_id, spi_cpha0, freq=2*freq, sideset_base=Pin(pin_sck), out_base=Pin(pin_mosi), in_base=Pin(pin_miso))
+            self._program = spi_cpha0_write if write_only else spi_cpha0
+            self._sm_freq = 2*freq
         else:
-            self._sm = rp2.StateMachine(sm_id, spi_cpha1, freq=4*freq, sideset_base=Pin(pin_sck), out_base=Pin(pin_mosi), in_base=Pin(pin_miso))
+            self._program = spi_cpha1_write if write_only else spi_cpha1
+            self._sm_freq = 4*freq
+        self._pins = {'sideset_base': Pin(pin_sck), 'out_base': Pin(pin_mosi), 'in_base': Pin(pin_miso)}
+
+        self._sm_id = sm_id
+        self._write_only = write_only
+
+        # DMA needs a firmware with rp2.DMA, else the FIFO is written by the CPU
+        self._use_dma = write_only and dma and hasattr(rp2, 'DMA')
+        self._dma = None
+
+        # Time to shift out the last byte after the FIFO drained
+        self._byte_us = (8 * 1000000 + freq - 1) // freq
+
+        self.init()
+
+    def init(self):
+        """Configure the pins for the state machine and claim a DMA channel
+
+        Call it again after deinit(), e.g. when the pins were used as GPIOs.
+        """
+        self._sm = rp2.StateMachine(self._sm_id, self._program, freq=self._sm_freq, **self._pins)
         self._sm.active(1)
 
+        if self._use_dma and not self._dma:
+            self._dma = rp2.DMA()
+
+    def deinit(self):
+        """Stop the state machine and release the DMA channel, there are only 12"""
+        self._sm.active(0)
+
+        if self._dma:
+            self._dma.close()
+            self._dma = None
+
+    def _check_read(self):
+        if self._write_only:
+            raise OSError('PIOSPI is write_only, MISO is not sampled')
+
+    def _drain(self):
+        """Wait until the last byte was shifted out"""
+        while self._sm.tx_fifo():
+            pass
+        time.sleep_us(self._byte_us)
+
+    def write_bulk(self, wdata):
+        """Put the whole buffer into the TX FIFO, only for write_only"""
+        self._sm.put(wdata, 24)
+        self._drain()
+
+    def write_dma(self, wdata):
+        """Move the whole buffer into the TX FIFO with DMA, only for write_only
+
+        Byte writes are replicated to all byte lanes, so the
+        byte ends up in the upper 8 bits that are shifted out first.
+        """
+        pio = self._sm_id // 4
+        sm = self._sm_id % 4
+
+        ctrl = self._dma.pack_ctrl(size=0, inc_write=False, treq_sel=DREQ_PIO_TX0[pio] + sm)
+        self._dma.config(read=wdata, write=PIO_BASE[pio] + PIO_TXF0 + 4 * sm, count=len(wdata), ctrl=ctrl, trigger=True)
+
+        while self._dma.active():
+            pass
+        self._drain()
+
     @micropython.native
     def write(self, wdata):
+        if self._dma:
+            return self.write_dma(wdata)
+        if self._write_only:
+            return self.write_bulk(wdata)
+
         first = True
         for b in wdata:
             self._sm.put(b, 24)
@@ -36,10 +125,12 @@ class PIOSPI:
         self._sm.get()
         
     def read(self, n):
+        self._check_read()
         return self.write_read_blocking([0,]*n)
 
     @micropython.native
     def readinto(self, rdata):
+        self._check_read()
         self._sm.put(0)
         for i in range(len(rdata)-1):
             self._sm.put(0)
@@ -48,6 +139,7 @@ class PIOSPI:
 
     @micropython.native
     def write_read_blocking(self, wdata):
+        self._check_read()
         rdata = bytearray(len(wdata))
         i = -1
         for b in wdata:
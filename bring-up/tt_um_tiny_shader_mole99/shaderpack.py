@@ -0,0 +1,47 @@
+import struct
+
+# Shader pack reader for MicroPython, see sw/shaderpack.py for the format
+# The pack is read into a single buffer, each shader is a memoryview slice of it
+
+MAGIC = b'TSPK'
+VERSION = 1
+
+HEADER = '<4sBBH'
+ENTRY = '<16sI'
+
+HEADER_SIZE = 8
+ENTRY_SIZE = 20
+
+class ShaderPack:
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+
+        magic, version, self.num_instr, count = struct.unpack_from(HEADER, self.data, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a shader pack')
+
+        self.names = []
+        self.offsets = []
+
+        for i in range(count):
+            name, offset = struct.unpack_from(ENTRY, self.data, HEADER_SIZE + ENTRY_SIZE * i)
+            self.names.append(name.split(b'\0')[0].decode())
+            self.offsets.append(offset)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, key):
+        """Get a shader by name or by index"""
+        if isinstance(key, str):
+            key = self.names.index(key)
+
+        offset = self.offsets[key]
+        return self.data[offset:offset + self.num_instr]
@@ -2,9 +2,14 @@ import time
 import sys
 import gc
 import random
+import select
+import struct
+import micropython
 from machine import Pin
 from machine import SoftSPI
 from .pio_spi import PIOSPI
+from .shaderpack import ShaderPack
+from . import link
 from ttboard.demoboard import DemoBoard, Pins
 
 def send_cmd(tt, spi, cmd):
@@ -19,188 +24,340 @@ def send_data(tt, spi, data):
     spi.write(data)
     tt.uio_in[0] = 1 # stop
 
-shader_test1 = bytes([
-    0b00111000, # CLEAR R0
-    0b00000000, # SETRGB R0
-    0b00010001, # GETX R1
-    0b00010110, # GETY R2
-    0b00011000, # GETTIME R0
-    0b00100001, # IFEQ R1
-    0b00000001, # SETRGB R1
-    0b00100010, # IFEQ R2
-    0b00000010, # SETRGB R2
-    0b01000000, # NOP
-])
-
-shader_test2 = bytes([
-    0b00011010, # GETTIME R2
-    0b00010000, # GETX R0
-    0b10011000, # ADD R0 R2
-    0b00111101, # SINE R1
-    0b00000101, # SETR R1
-    0b00010100, # GETY R0
-    0b10011000, # ADD R0 R2
-    0b00111101, # SINE R1
-    0b00001001, # SETG R1
-    0b01000000, # NOP
-])
-
-shader_test3 = bytes([
-    0b00010000, # GETX R0
-    0b00000100, # SETR R0
-    0b00010101, # GETY R1
-    0b00001001, # SETG R1
-    0b01000000, # NOP
-    0b01000000, # NOP
-    0b01000000, # NOP
-    0b01000000, # NOP
-    0b01000000, # NOP
-    0b01000000, # NOP
-])
-
-shader_test4 = bytes([
-    0b00010000, # GETX R0
-    0b00010101, # GETY R1
-    0b01110100, # XOR R0 R1
-    0b00011010, # GETTIME R2
-    0b10011000, # ADD R0 R2
-    0b00000000, # SETRGB R0
-    0b01000000, # NOP
-    0b01000000, # NOP
-    0b01000000, # NOP
-    0b01000000, # NOP
-])
-
-shader_test5 = bytes([
-    0b00010101, # GETY R1
-    0b11000001, # LDI 1
-    0b01000001, # AND R1 R0
-    0b00100101, # IFNE R1
-    0b11111111, # LDI 63
-    0b00100001, # IFEQ R1
-    0b11000000, # LDI 0
-    0b00000000, # SETRGB R0
-    0b01000000, # NOP
-    0b01000000, # NOP
-])
-
-shader_test6 = bytes([
-    0b00010001, # GETX R1
-    0b11000001, # LDI 1
-    0b01000001, # AND R1 R0
-    0b00100101, # IFNE R1
-    0b11111111, # LDI 63
-    0b00100001, # IFEQ R1
-    0b11000000, # LDI 0
-    0b00000000, # SETRGB R0
-    0b01000000, # NOP
-    0b01000000, # NOP
-])
-
-shader_test7 = bytes([
-    0b00111011, # CLEAR R3
-    0b00010000, # GETX R0
-    0b00011001, # GETTIME R1
-    0b10010100, # ADD R0 R1
-    0b00000000, # SETRGB R0
-    0b00111100, # SINE R0
-    0b00110100, # HALF R0
-    0b00010101, # GETY R1
-    0b00101001, # IFGE R1
-    0b00000011, # SETRGB R3
-])
-
-shader_test8 = bytes([
-    0b00111011, # CLEAR R3
-    0b00010100, # GETY R0
-    0b00011001, # GETTIME R1
-    0b10010100, # ADD R0 R1
-    0b00000000, # SETRGB R0
-    0b00111100, # SINE R0
-    0b00110100, # HALF R0
-    0b00010001, # GETX R1
-    0b00101001, # IFGE R1
-    0b00000011, # SETRGB R3
-])
-
-shader_test9 = bytes([
-    0b00010000, # GETX R0
-    0b00111110, # SINE R2
-    0b00010100, # GETY R0
-    0b00111100, # SINE R0
-    0b10011000, # ADD R0 R2
-    0b00011001, # GETTIME R1
-    0b10010100, # ADD R0 R1
-    0b00011101, # GETUSER R1
-    0b10010100, # ADD R0 R1
-    0b00000000, # SETRGB R0
-])
-
-shader_test10 = bytes([
-    0b00010000, # GETX R0
-    0b00011001, # GETTIME R1
-    0b10010100, # ADD R0 R1
-    0b00111110, # SINE R2
-    0b00010100, # GETY R0
-    0b00011001, # GETTIME R1
-    0b10010100, # ADD R0 R1
-    0b00111100, # SINE R0
-    0b10011000, # ADD R0 R2
-    0b00000000, # SETRGB R0
-])
-
-shader_test11 = bytes([
-    0b00110000, # DOUBLE R0
-    0b00000000, # SETRGB R0
-    0b00111011, # CLEAR R3
-    0b00100011, # IFEQ R3
-    0b00011000, # GETTIME R0
-    0b01000000, # NOP
-    0b01000000, # NOP
-    0b01000000, # NOP
-    0b01000000, # NOP
-    0b01000000, # NOP
-])
-
-shader_test12 = bytes([
-    0b00010000, # GETX R0
-    0b00111101, # SINE R1
-    0b00010100, # GETY R0
-    0b00111100, # SINE R0
-    0b01110100, # XOR R0 R1
-    0b00011001, # GETTIME R1
-    0b10010100, # ADD R0 R1
-    0b00000000, # SETRGB R0
-    0b01000000, # NOP
-    0b01000000, # NOP
-])
-
-shaders = [
-    shader_test1,
-    shader_test2,
-    shader_test3,
-    shader_test4,
-    shader_test5,
-    shader_test6,
-    shader_test7,
-    shader_test8,
-    shader_test9,
-    shader_test10,
-    shader_test11,
-    shader_test12,
-]
+# SCK is sampled with the project clock, stay well below 25.175 MHz / 2
+SPI_FREQ = int(5e6)
+
+def create_spi(tt):
+    return PIOSPI(sm_id=0, pin_mosi=tt.pins.pin_uio1, pin_miso=tt.pins.pin_uio2, pin_sck=tt.pins.pin_uio3, cpha=True, cpol=False, freq=SPI_FREQ, write_only=True, dma=True)
+
+def wait_vsync(tt):
+    """Wait until vsync is low, the vertical back porch of 33 lines (1 ms) follows"""
+    vsync = tt.pins.pin_uo_out3
+    while vsync.value():
+        pass
+
+def load_shader(tt, spi, shader, verbose=True):
+    """Upload a shader over SPI while the design keeps running
+
+    Each received byte shifts the shader memory, which also shifts
+    while the shader executes in the active area. The upload starts
+    in the vertical blanking, the 10 bytes take 16 us at 5 MHz.
+    The clock and TIME keep running. Returns the latency in us.
+    """
+    start = time.ticks_us()
+
+    wait_vsync(tt)
+    vsync = time.ticks_us()
+
+    send_data(tt, spi, shader)
+    end = time.ticks_us()
+
+    latency = time.ticks_diff(end, start)
+    if verbose:
+        print(f'Shader upload complete: {latency} us, {time.ticks_diff(end, vsync)} us after vsync')
+
+    return latency
+
+# The vertical blanking is 45 lines (1430 us) at 25.175 MHz,
+# a commit has to start before COMMIT_US to finish in it
+COMMIT_US = 1300
+
+# 800 x 525 clock cycles at 25.175 MHz
+FRAME_US = 16683
+
+class FrameScheduler:
+    """Call commit() once per frame in the vertical blanking
+
+    next_frame (uio5) pulses at the end of the last visible line.
+    The hard IRQ only timestamps the pulse and schedules the commit.
+    commit(frames, late) gets the frames since the last commit, more
+    than one if the CPU was busy, and whether it is too late to finish
+    in the vertical blanking. It returns the number of missed frames.
+    """
+
+    def __init__(self, tt, spi):
+        self.tt = tt
+        self.spi = spi
+
+        self.pulses = 0
+        self.handled = 0
+        self.pulse_us = 0
+        self.queued = False
+
+        self.committed = 0
+        self.missed = 0
+
+        # Allocating a bound method is not allowed in a hard IRQ
+        self._commit_ref = self._commit
+
+        self.pin = tt.pins.pin_uio5
+
+    @property
+    def done(self):
+        return False
+
+    def start(self):
+        self.pin.init(Pin.IN)
+        self.pin.irq(handler=self._on_frame, trigger=Pin.IRQ_RISING, hard=True)
+
+    def stop(self):
+        self.pin.irq(handler=None)
+
+    def run(self):
+        """Run until done, returns the number of missed frames"""
+        self.start()
+        while not self.done:
+            time.sleep_ms(1)
+        self.stop()
+
+        return self.missed
+
+    def _on_frame(self, pin):
+        self.pulse_us = time.ticks_us()
+        self.pulses += 1
+
+        # At most one commit is queued, it handles the latest pulse
+        if not self.queued:
+            try:
+                micropython.schedule(self._commit_ref, None)
+                self.queued = True
+            except RuntimeError:
+                # Queue full, counted as missed by the next commit
+                pass
+
+    def _commit(self, arg):
+        self.queued = False
+
+        if self.done:
+            return
+
+        pulse = self.pulses
+        frames = pulse - self.handled
+        self.handled = pulse
+
+        late = time.ticks_diff(time.ticks_us(), self.pulse_us) > COMMIT_US
+
+        self.missed += self.commit(frames, late)
+
+    def commit(self, frames, late):
+        return 0
+
+class UserScheduler(FrameScheduler):
+    """Commit one USER value per frame
+
+    A late value is sent in the next frame instead. Frames
+    without a commit while values are left are counted as missed.
+    """
+
+    def __init__(self, tt, spi, values):
+        super().__init__(tt, spi)
+
+        self.values = iter(values)
+        self.pending = next(self.values, None)
+
+    @property
+    def done(self):
+        return self.pending is None
+
+    def commit(self, frames, late):
+        if late:
+            return frames
+
+        send_cmd(self.tt, self.spi, bytes([self.pending & 0x3F]))
+        self.committed += 1
+
+        self.pending = next(self.values, None)
+
+        return frames - 1
+
+def duration_frames(duration_ms):
+    """Number of frames closest to a duration, at least one"""
+    return max(1, (duration_ms * 1000 + FRAME_US // 2) // FRAME_US)
+
+class ShaderPlayer(FrameScheduler):
+    """Play a list of (shader, duration in ms) from a resident bank
+
+    The shaders stay in memory, e.g. as slices of the shader pack.
+    A switch shifts the 10 words into the shader memory in the vertical
+    blanking and takes effect with the next frame, without a reset.
+    TIME keeps running. Durations are counted in frames. A late switch
+    is done in the next frame and the frames it was late are missed.
+    """
+
+    def __init__(self, tt, spi, playlist, loop=False):
+        super().__init__(tt, spi)
+
+        self.playlist = [(shader, duration_frames(duration)) for shader, duration in playlist]
+        self.loop = loop
+
+        # The first switch is due with the first pulse
+        self.index = 0
+        self.remaining = 1
+        self.finished = not self.playlist
+
+        # Frame of each switch, counted from start()
+        self.switches = []
+
+    @property
+    def done(self):
+        return self.finished
+
+    def commit(self, frames, late):
+        self.remaining -= frames
+
+        if self.remaining > 0:
+            return 0
+
+        if self.index >= len(self.playlist):
+            if not self.loop:
+                self.finished = True
+                return 0
+            self.index = 0
+
+        if late:
+            missed = 1 - self.remaining
+            self.remaining = 1
+            return missed
+
+        missed = -self.remaining
+
+        shader, frames = self.playlist[self.index]
+        self.index += 1
+
+        send_data(self.tt, self.spi, shader)
+        self.committed += 1
+        self.switches.append(self.handled)
+
+        self.remaining = frames
+
+        return missed
+
+class LinkServer:
+    """Handle requests of the binary protocol, see sw/shaderlink.py
+
+    Runs until an EXIT request. Between requests the
+    playlist advances. Nothing else may be printed.
+    """
+
+    def __init__(self, tt, spi, rx, tx, num_instr=10):
+        self.tt = tt
+        self.spi = spi
+        self.rx = rx
+        self.tx = tx
+        self.num_instr = num_instr
+
+        self.playlist = []
+        self.playing = False
+        self.loop = False
+        self.index = 0
+        self.switch_ms = 0
+
+        self.poll = select.poll()
+        self.poll.register(rx, select.POLLIN)
+
+    def serve(self):
+        # Ctrl-C is a valid byte of a frame
+        micropython.kbd_intr(-1)
+
+        try:
+            while True:
+                if self.poll.poll(self.timeout_ms()):
+                    if not self.handle(*link.read_frame(self.rx)):
+                        break
+
+                if self.playing and time.ticks_diff(time.ticks_ms(), self.switch_ms) >= 0:
+                    self.next_entry()
+        finally:
+            micropython.kbd_intr(3)
+
+    def timeout_ms(self):
+        """Time until the next playlist entry, -1 to wait forever"""
+        if not self.playing:
+            return -1
+        return max(0, time.ticks_diff(self.switch_ms, time.ticks_ms()))
+
+    def next_entry(self):
+        if self.index >= len(self.playlist):
+            if not self.loop or not self.playlist:
+                self.playing = False
+                return
+            self.index = 0
+
+        duration, shader = self.playlist[self.index]
+        self.index += 1
+
+        load_shader(self.tt, self.spi, shader, verbose=False)
+        self.switch_ms = time.ticks_add(time.ticks_ms(), duration)
+
+    def handle_playlist(self, payload):
+        entry_size = link.ENTRY_SIZE + self.num_instr
+
+        if not payload or (len(payload) - 1) % entry_size:
+            return link.BAD_LENGTH
+
+        flags = payload[0]
+
+        if flags & link.CLEAR:
+            self.playlist = []
+            self.playing = False
+
+        for offset in range(1, len(payload), entry_size):
+            duration = struct.unpack_from('<H', payload, offset)[0]
+            self.playlist.append((duration, bytes(payload[offset + link.ENTRY_SIZE:offset + entry_size])))
+
+        if flags & link.PLAY:
+            self.playing = True
+            self.loop = bool(flags & link.LOOP)
+            self.index = 0
+            self.switch_ms = time.ticks_ms()
+
+        return link.OK
+
+    def handle(self, frame_type, seq, payload, crc_ok):
+        """Handle a request and send the response, returns False on EXIT"""
+        status = link.OK
+        data = b''
+
+        if not crc_ok:
+            status = link.BAD_CRC
+        elif frame_type == link.PING:
+            pass
+        elif frame_type == link.SHADER:
+            if len(payload) != self.num_instr:
+                status = link.BAD_LENGTH
+            else:
+                data = struct.pack('<I', load_shader(self.tt, self.spi, payload, verbose=False))
+        elif frame_type == link.USER:
+            if len(payload) != 1:
+                status = link.BAD_LENGTH
+            else:
+                send_cmd(self.tt, self.spi, payload)
+        elif frame_type == link.PLAYLIST:
+            status = self.handle_playlist(payload)
+        elif frame_type == link.STOP:
+            self.playing = False
+        elif frame_type != link.EXIT:
+            status = link.BAD_TYPE
+
+        self.tx.write(link.encode(link.RESPONSE | frame_type, seq, bytes([status]) + data))
+
+        return not (crc_ok and frame_type == link.EXIT)
+
+# All shaders are kept in one pack generated by the assembler (make bits in sw/)
+shaders = ShaderPack.from_file(__file__.rsplit('/', 1)[0] + '/shaders.pack')
 
 shaders_slideshow = [
-    shader_test9,
-    shader_test2,
-    shader_test1,
-    shader_test4,
-    shader_test8,
-    shader_test5,
-    shader_test10,
-    shader_test12,
+    shaders['test9'],
+    shaders['test2'],
+    shaders['test1'],
+    shaders['test4'],
+    shaders['test8'],
+    shaders['test5'],
+    shaders['test10'],
+    shaders['test12'],
 ]
 
+# Fallback, stops the clock and resets the design
 def load_shader_manual_clock(tt, shader):
     print('Loading new shader')
 
@@ -283,9 +440,9 @@ def load_project(tt:DemoBoard):
     tt.shuttle.tt_um_tiny_shader_mole99.enable()
     return True
 
-def select_shader(tt, index):
+def select_shader(tt, spi, index):
     if 0 <= index < len(shaders):
-        load_shader_manual_clock(tt, shaders[index])
+        load_shader(tt, spi, shaders[index])
     else:
         print(f'Invalid shader index: {index}')
         print(f'Max index: {len(shaders)-1}')
@@ -298,13 +455,15 @@ def main():
     
     tt.uio_oe_pico.value = 0 # all inputs
     
+    spi = create_spi(tt)
+    
     """tt.rst_n.mode = Pins.OUT
     tt.rst_n(0)
     time.sleep_ms(1000)
     tt.rst_n(1)"""
     
     while 1:
-        print('Please input shader index or action ("user", "count", "slideshow", "random"): ')
+        print('Please input shader index or action ("user", "count", "slideshow", "random", "manual", "link"): ')
         
         input = sys.stdin.readline().rstrip()
         print(f'"{input}"')
@@ -316,26 +475,36 @@ def main():
             print(input)
             
             user = int(input)
-            spi = PIOSPI(sm_id=0, pin_mosi=tt.pins.pin_uio1, pin_miso=tt.pins.pin_uio2, pin_sck=tt.pins.pin_uio3, cpha=True, cpol=False, freq=int(5e6))
             send_cmd(tt, spi, user.to_bytes(1, sys.byteorder))
         elif input == 'count':
-            spi = PIOSPI(sm_id=0, pin_mosi=tt.pins.pin_uio1, pin_miso=tt.pins.pin_uio2, pin_sck=tt.pins.pin_uio3, cpha=True, cpol=False, freq=int(5e6))
-        
-            for i in range(64):
-                send_cmd(tt, spi, i.to_bytes(1, sys.byteorder))
-                time.sleep_ms(16)
+            scheduler = UserScheduler(tt, spi, range(64))
+            scheduler.run()
+            print(f'{scheduler.committed} values, {scheduler.missed} missed frames')
         elif input == 'slideshow':
-            for shader in shaders_slideshow:
-                load_shader_manual_clock(tt, shader)
-                time.sleep(6)
+            player = ShaderPlayer(tt, spi, [(shader, 6000) for shader in shaders_slideshow])
+            player.run()
+            print(f'{player.committed} shaders, {player.missed} missed frames')
         elif input == 'random':
-            for i in range(10):
-                index = random.randint(0, len(shaders)-1)
-                load_shader_manual_clock(tt, shaders[index])
-                time.sleep(5)
+            player = ShaderPlayer(tt, spi, [(shaders[random.randint(0, len(shaders)-1)], 5000) for i in range(10)])
+            player.run()
+            print(f'{player.committed} shaders, {player.missed} missed frames')
+        elif input == 'link':
+            # Binary protocol until EXIT, see sw/shaderlink.py
+            LinkServer(tt, spi, sys.stdin.buffer, sys.stdout.buffer).serve()
+        elif input == 'manual':
+            print('Please input shader index: ')
+            
+            input = sys.stdin.readline().rstrip()
+            print(input)
+            
+            spi.deinit()
+            load_shader_manual_clock(tt, shaders[int(input)])
+            
+            # The pins were reconfigured as GPIOs
+            spi.init()
         else:
             try:
-                select_shader(tt, int(input))
+                select_shader(tt, spi, int(input))
             except:
                 print('Invalid input.')
 """
@@ -3,6 +3,12 @@
 
 `default_nettype none
 
+// Default program of the simulation, the Makefile
+// of the testbench passes it as an absolute path
+`ifndef DEFAULT_SHADER
+`define DEFAULT_SHADER "../sw/binary/test4.bit"
+`endif
+
 module shader_memory #(
     parameter NUM_INSTR = 8
 )(
@@ -20,7 +26,7 @@ module shader_memory #(
     always_ff @(posedge clk_i, negedge rst_ni) begin
         if (!rst_ni) begin
             `ifdef COCOTB_SIM
-            $readmemb("../sw/binary/test4.bit", memory);
+            $readmemb(`DEFAULT_SHADER, memory);
             `else
             // Load the default program (test4)
             memory[0] <= 8'b00_0100_00; // GETX R0
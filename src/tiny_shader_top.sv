@@ -3,7 +3,22 @@
 
 `default_nettype none
 
-module tiny_shader_top (
+module tiny_shader_top #(
+    /*
+        VGA 640x480 @ 60 Hz
+        clock = 25.175 MHz
+    */
+    parameter WIDTH    = 640,
+    parameter HEIGHT   = 480,
+
+    parameter HFRONT   = 16,
+    parameter HSYNC    = 96,
+    parameter HBACK    = 48,
+
+    parameter VFRONT   = 10,
+    parameter VSYNC    = 2,
+    parameter VBACK    = 33
+)(
     input  logic        clk_i,
     input  logic        rst_ni,
     
@@ -34,21 +49,7 @@ module tiny_shader_top (
     
     localparam NUM_INSTR = 10;
 
-    /*
-        VGA 640x480 @ 60 Hz
-        clock = 25.175 MHz
-    */
-
-    localparam WIDTH    = 640;
-    localparam HEIGHT   = 480;
-    
-    localparam HFRONT   = 16;
-    localparam HSYNC    = 96;
-    localparam HBACK    = 48;
-
-    localparam VFRONT   = 10;
-    localparam VSYNC    = 2;
-    localparam VBACK    = 33;
+    /* Timing, see the parameters */
     
     localparam HTOTAL = WIDTH + HFRONT + HSYNC + HBACK;
     localparam VTOTAL = HEIGHT + VFRONT + VSYNC + VBACK;
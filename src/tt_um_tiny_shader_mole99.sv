@@ -37,7 +37,18 @@ module tt_um_tiny_shader_mole99 (
     logic [1:0] debug_o;
     
     tiny_shader_top #(
-    
+    `ifdef SMALL_GEOMETRY
+        // Reduced geometry for faster simulations,
+        // same as SMALL in sw/hwmodel.py
+        .WIDTH  (160),
+        .HEIGHT (120),
+        .HFRONT (4),
+        .HSYNC  (24),
+        .HBACK  (12),
+        .VFRONT (2),
+        .VSYNC  (2),
+        .VBACK  (30)
+    `endif
     ) tiny_shader_top_inst (
         .clk_i      (clk),
         .rst_ni     (rst_n_sync),
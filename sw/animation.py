@@ -0,0 +1,232 @@
+import sys
+import zlib
+import struct
+from fractions import Fraction
+
+import numpy as np
+
+# RGB222 channel value to RGB888 channel value, same as the assembler
+COLOR_LUT = [0, 127, 128, 255]
+
+def upscale(frame, factor):
+    """Nearest-neighbour upscale of an (height, width, 3) frame by an integer factor"""
+    if factor == 1:
+        return frame
+
+    height, width, channels = frame.shape
+
+    frame = np.broadcast_to(frame[:, np.newaxis, :, np.newaxis, :], (height, factor, width, factor, channels))
+    return frame.reshape(height*factor, width*factor, channels)
+
+def color_index(frame):
+    """Map an RGB888 frame back to the 6-bit rrggbb value of each pixel"""
+    frame = frame >> 6
+    return (frame[..., 0] << 4 | frame[..., 1] << 2 | frame[..., 2]).astype(np.uint8)
+
+class GifWriter:
+    """Write an animated GIF frame by frame
+
+    All 64 colors of the shader fit into the global color table,
+    so each frame is written as soon as it is rendered.
+    """
+
+    def __init__(self, f, width, height, fps):
+        self.f = f
+        self.width = width
+        self.height = height
+        self.delay = round(100 / fps)
+
+        palette = bytearray()
+        for index in range(64):
+            palette += bytes([COLOR_LUT[index >> 4 & 0x3], COLOR_LUT[index >> 2 & 0x3], COLOR_LUT[index & 0x3]])
+
+        # Header and logical screen descriptor with a global color table of 64 entries
+        self.f.write(b'GIF89a')
+        self.f.write(struct.pack('<HHBBB', width, height, 0xF5, 0, 0))
+        self.f.write(palette)
+
+        # Loop forever
+        self.f.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', 0) + b'\x00')
+
+    def write(self, frame):
+        # Graphic control extension with the frame delay
+        self.f.write(b'\x21\xF9\x04\x00' + struct.pack('<H', self.delay) + b'\x00\x00')
+
+        # Image descriptor
+        self.f.write(b'\x2C' + struct.pack('<HHHHB', 0, 0, self.width, self.height, 0))
+
+        data = lzw_encode(color_index(frame).tobytes(), 6)
+
+        self.f.write(bytes([6]))
+        for i in range(0, len(data), 255):
+            block = data[i:i+255]
+            self.f.write(bytes([len(block)]) + block)
+        self.f.write(b'\x00')
+
+    def close(self):
+        self.f.write(b'\x3B')
+        self.f.close()
+
+def lzw_encode(data, min_code_size):
+    """Variable length LZW compression as used by GIF"""
+    clear = 1 << min_code_size
+    end = clear + 1
+
+    out = bytearray()
+    bits = 0
+    num_bits = 0
+
+    code_size = min_code_size + 1
+    next_code = end + 1
+    table = {}
+
+    def emit(code):
+        nonlocal bits, num_bits
+        bits |= code << num_bits
+        num_bits += code_size
+        while num_bits >= 8:
+            out.append(bits & 0xFF)
+            bits >>= 8
+            num_bits -= 8
+
+    emit(clear)
+
+    prefix = data[0]
+
+    for k in data[1:]:
+        key = prefix << 8 | k
+        code = table.get(key)
+
+        if code is not None:
+            prefix = code
+            continue
+
+        emit(prefix)
+
+        # The decoder needs one more bit for the code added next
+        if next_code >= (1 << code_size) and code_size < 12:
+            code_size += 1
+
+        if next_code < 4095:
+            table[key] = next_code
+            next_code += 1
+        else:
+            emit(clear)
+            table = {}
+            code_size = min_code_size + 1
+            next_code = end + 1
+
+        prefix = k
+
+    emit(prefix)
+    emit(end)
+
+    if num_bits:
+        out.append(bits & 0xFF)
+
+    return bytes(out)
+
+class ApngWriter:
+    """Write an animated PNG frame by frame
+
+    The number of frames is part of the header and is
+    corrected on close if the file is seekable.
+    """
+
+    def __init__(self, f, width, height, fps, num_frames):
+        self.f = f
+        self.width = width
+        self.height = height
+        self.delay = Fraction(1 / fps).limit_denominator(1000)
+        self.num_frames = 0
+        self.sequence = 0
+
+        self.f.write(b'\x89PNG\r\n\x1a\n')
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+        self.actl_pos = self.f.tell() if self.f.seekable() else None
+        self.chunk(b'acTL', struct.pack('>II', num_frames, 0))
+
+    def chunk(self, chunk_type, data):
+        self.f.write(struct.pack('>I', len(data)) + chunk_type + data)
+        self.f.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+    def write(self, frame):
+        self.chunk(b'fcTL', struct.pack('>IIIIIHHBB', self.sequence, self.width, self.height, 0, 0,
+                                        self.delay.numerator, self.delay.denominator, 0, 0))
+        self.sequence += 1
+
+        # Filter type 0 for every scanline
+        scanlines = np.zeros((self.height, self.width*3 + 1), dtype=np.uint8)
+        scanlines[:, 1:] = frame.reshape(self.height, self.width*3)
+        data = zlib.compress(scanlines.tobytes())
+
+        if self.num_frames == 0:
+            self.chunk(b'IDAT', data)
+        else:
+            self.chunk(b'fdAT', struct.pack('>I', self.sequence) + data)
+            self.sequence += 1
+
+        self.num_frames += 1
+
+    def close(self):
+        self.chunk(b'IEND', b'')
+
+        if self.actl_pos is not None:
+            self.f.seek(self.actl_pos)
+            self.chunk(b'acTL', struct.pack('>II', self.num_frames, 0))
+
+        self.f.close()
+
+class RawWriter:
+    """Write raw RGB888 frames, e.g. for ffmpeg -f rawvideo -pix_fmt rgb24"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, frame):
+        self.f.write(np.ascontiguousarray(frame).tobytes())
+        self.f.flush()
+
+    def close(self):
+        pass
+
+class Y4mWriter:
+    """Write YUV4MPEG2 frames with 4:4:4 sampling and BT.601 colors"""
+
+    def __init__(self, f, width, height, fps):
+        self.f = f
+
+        rate = Fraction(fps).limit_denominator(1001)
+        self.f.write(f'YUV4MPEG2 W{width} H{height} F{rate.numerator}:{rate.denominator} Ip A1:1 C444\n'.encode())
+
+    def write(self, frame):
+        r, g, b = [frame[..., i].astype(np.float32) for i in range(3)]
+
+        y = 16  + 0.257*r + 0.504*g + 0.098*b
+        u = 128 - 0.148*r - 0.291*g + 0.439*b
+        v = 128 + 0.439*r - 0.368*g - 0.071*b
+
+        self.f.write(b'FRAME\n')
+        for plane in (y, u, v):
+            self.f.write(np.clip(np.rint(plane), 0, 255).astype(np.uint8).tobytes())
+        self.f.flush()
+
+    def close(self):
+        pass
+
+def open_animation(path, width, height, fps, num_frames):
+    """Open a GIF or APNG writer depending on the file extension"""
+    f = open(path, 'wb')
+
+    if path.endswith('.gif'):
+        return GifWriter(f, width, height, fps)
+
+    return ApngWriter(f, width, height, fps, num_frames)
+
+def open_stream(fmt, width, height, fps):
+    """Open a raw RGB or y4m writer on stdout"""
+    if fmt == 'y4m':
+        return Y4mWriter(sys.stdout.buffer, width, height, fps)
+
+    return RawWriter(sys.stdout.buffer)
@@ -1,7 +1,11 @@
 import os
 import sys
 import math
+import hashlib
+import importlib.util
+import functools
 import argparse
+from array import array
 
 instructions = {
 
@@ -144,131 +148,757 @@ def assemble(program, verbose=False):
 
     return assembled
 
+# Tiny Shader Settings
+NUM_INSTR = 10
+
+# Opcodes of the decoded instructions, in the order of the instructions table
+OPCODES = [name for name, instr in instructions.items() if instr['format'] != 'pseudo']
+
+(OP_SETRGB, OP_SETR, OP_SETG, OP_SETB,
+ OP_GETX, OP_GETY, OP_GETTIME, OP_GETUSER,
+ OP_IFEQ, OP_IFNE, OP_IFGE, OP_IFLT,
+ OP_DOUBLE, OP_HALF, OP_CLEAR, OP_SINE,
+ OP_AND, OP_OR, OP_NOT, OP_XOR,
+ OP_MOV, OP_ADD, OP_SHIFTL, OP_SHIFTR,
+ OP_LDI) = range(len(OPCODES))
+
+# NOP is encoded as AND R0 R0
+NOP_WORD = 0b01_00_00_00
+
+# Sine LUT with 16 entries, mirrored by the shader
+SINE_LUT = [int(0x3F*math.sin(math.radians(90.0/15*i))) for i in range(16)]
+
+def _decode_entry(word):
+    """Decode an instruction word into (mnemonic, format, ra, rb, imm), unused fields are None"""
+    bits = f'{word:08b}'
+
+    for name in OPCODES:
+        instr = instructions[name]
+
+        if bits.startswith(instr['opcode'].replace('_', '')):
+            if instr['format'] == 'immediate':
+                return (name, instr['format'], None, None, word & 0x3F)
+            elif instr['format'] == 'dual_operand':
+                return (name, instr['format'], word & 0x3, word >> 2 & 0x3, None)
+            else:
+                return (name, instr['format'], word & 0x3, None, None)
+
+# Every word is a valid instruction, all of them are decoded once
+DECODE_TABLE = [_decode_entry(word) for word in range(256)]
+
+# Opcode of each word, used by decode()
+OPCODE_TABLE = [OPCODES.index(entry[0]) for entry in DECODE_TABLE]
+
+def decode(word):
+    """Decode an instruction word into (opcode, ra, rb, imm)"""
+    return (OPCODE_TABLE[word], word & 0x3, word >> 2 & 0x3, word & 0x3F)
+
+def disassemble_word(word):
+    """Turn an instruction word back into assembly"""
+    if word == NOP_WORD:
+        return 'NOP'
+
+    name, fmt, ra, rb, imm = DECODE_TABLE[word]
+
+    if fmt == 'immediate':
+        return f'{name} {imm}'
+    elif fmt == 'dual_operand':
+        return f'{name} R{ra} R{rb}'
+    else:
+        return f'{name} R{ra}'
+
+def disassemble(words):
+    """Turn instruction words back into shader source"""
+    return '\n'.join(disassemble_word(word) for word in words) + '\n'
+
+def parse_bit(text):
+    """Parse the binary text format into a list of instruction words"""
+    words = []
+
+    for line in text.splitlines():
+        line = line.split('//', 1)[0].replace('_', '').strip()
+        if line:
+            words.append(int(line, 2))
+
+    return words
+
+class Program:
+    """A shader program, decoded once
+
+    The instruction words and their decoded fields are kept in
+    compact arrays. Iterating yields (opcode, ra, rb, imm) tuples.
+    """
+
+    __slots__ = ('words', 'opcode', 'ra', 'rb', 'imm')
+
+    def __init__(self, words):
+        self.words = array('B', words)
+
+        decoded = [decode(word) for word in self.words]
+
+        self.opcode = array('B', [instr[0] for instr in decoded])
+        self.ra = array('B', [instr[1] for instr in decoded])
+        self.rb = array('B', [instr[2] for instr in decoded])
+        self.imm = array('B', [instr[3] for instr in decoded])
+
+    @classmethod
+    def from_source(cls, source):
+        """Assemble .shader source, filled up with NOPs"""
+        words = []
+
+        for word in parse_bit('\n'.join(assemble(source))):
+            # Only the immediate can exceed the instruction width
+            if word > 0xFF:
+                print('Warning: immediate out of range')
+                word = 0b11_000000 | word & 0x3F
+            words.append(word)
+
+        while len(words) < NUM_INSTR:
+            words.append(NOP_WORD)
+
+        return cls(words)
+
+    @classmethod
+    def from_bit(cls, text):
+        """Load the binary text format as written to .bit files"""
+        return cls(parse_bit(text))
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a .shader or .bit file"""
+        with open(path, 'r') as f:
+            text = f.read()
+
+        if path.endswith('.bit'):
+            return cls.from_bit(text)
+
+        return cls.from_source(text)
+
+    def digest(self):
+        """Content hash of the instruction words"""
+        return hashlib.sha1(self.words.tobytes()).hexdigest()
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return zip(self.opcode, self.ra, self.rb, self.imm)
+
+    def __getitem__(self, index):
+        return (self.opcode[index], self.ra[index], self.rb[index], self.imm[index])
+
+    def __eq__(self, other):
+        return isinstance(other, Program) and self.words == other.words
+
+    def __hash__(self):
+        return hash(self.words.tobytes())
+
+    def __repr__(self):
+        return f'Program({list(self.words)})'
+
 def simulate(program, x_pos=0, y_pos=0, time=0, user=0, verbose=False):
     """Simulate the shader program"""
 
+    if isinstance(program, str):
+        program = Program.from_source(program)
+
     register = [0, 0, 0, 0]
     rgb = [0, 0, 0]
     skip = 0
-    sine_lut = [int(0x3F*math.sin(math.radians(90.0/15*i))) for i in range(16)]
 
-    # Remove all comments
-    program = os.linesep.join([s.split('#', 1)[0] for s in program.splitlines()])
+    for opcode, ra, rb, imm in program:
 
-    # Remove all empty lines
-    program = os.linesep.join([s for s in program.splitlines() if s.strip()])
+        if skip:
+            if verbose:
+                print(f'Skipping instruction {OPCODES[opcode]}')
+            skip = 0
+            continue
 
-    # Process lines
-    for line in program.splitlines():
-        #print(f"Processing line: {line}")
-        
-        token = line.split()
-        
-        if token[0] in instructions:
-            instr = instructions[token[0]]
-            
-            if skip:
-                if verbose:
-                    print(f'Skipping instruction {token[0]}')
-                skip = 0
-                continue
+        if opcode == OP_LDI:
+            register[0] = imm
 
-            if instr['format'] == 'immediate':
-                if (len(token) != 2):
-                    print(f'Instruction {token[0]} expects one immediate')
-                imm = int(token[1], 0)
-                
-                if imm < 0 or imm > 0x3F:
-                    print('Warning: immediate out of range')
-                
-                if token[0] == 'LDI':
-                    register[0] = imm & 0x3F
+        elif opcode == OP_AND:
+            register[ra] = register[ra] & register[rb]
+        elif opcode == OP_OR:
+            register[ra] = register[ra] | register[rb]
+        elif opcode == OP_NOT:
+            register[ra] = ~register[rb] & 0x3F
+        elif opcode == OP_XOR:
+            register[ra] = register[ra] ^ register[rb]
 
-            if instr['format'] == 'dual_operand':
-                if (len(token) != 3):
-                    print(f'Instruction {token[0]} expects two operand')
+        elif opcode == OP_MOV:
+            register[ra] = register[rb]
+        elif opcode == OP_ADD:
+            register[ra] = register[ra] + register[rb] & 0x3F
+        elif opcode == OP_SHIFTL:
+            register[ra] = register[ra] << register[rb] & 0x3F
+        elif opcode == OP_SHIFTR:
+            register[ra] = register[ra] >> register[rb]
 
-                op0 = get_register(token[1])
-                op1 = get_register(token[2])
+        elif opcode == OP_SETRGB:
+            rgb[2] = register[ra] >> 4 & 0x3
+            rgb[1] = register[ra] >> 2 & 0x3
+            rgb[0] = register[ra] >> 0 & 0x3
+        elif opcode == OP_SETR:
+            rgb[2] = register[ra] & 0x3
+        elif opcode == OP_SETG:
+            rgb[1] = register[ra] & 0x3
+        elif opcode == OP_SETB:
+            rgb[0] = register[ra] & 0x3
 
-                if token[0] == 'AND':
-                    register[op0] = register[op0] & register[op1] & 0x3F
-                if token[0] == 'OR':
-                    register[op0] = register[op0] | register[op1] & 0x3F
-                if token[0] == 'NOT':
-                    register[op0] = ~register[op1] & 0x3F
-                if token[0] == 'XOR':
-                    register[op0] = register[op0] ^ register[op1] & 0x3F
-
-                if token[0] == 'MOV':
-                    register[op0] = register[op1] & 0x3F
-                if token[0] == 'ADD':
-                    register[op0] = register[op0] + register[op1] & 0x3F
-                if token[0] == 'SHIFTL':
-                    register[op0] = register[op0] << register[op1] & 0x3F
-                if token[0] == 'SHIFTR':
-                    register[op0] = register[op0] >> register[op1] & 0x3F
-
-            if instr['format'] == 'single_operand':
-                if (len(token) != 2):
-                    print(f'Instruction {token[0]} expects one operand')
+        elif opcode == OP_GETX:
+            register[ra] = x_pos & 0x3F
+        elif opcode == OP_GETY:
+            register[ra] = y_pos & 0x3F
+        elif opcode == OP_GETTIME:
+            register[ra] = time & 0x3F
+        elif opcode == OP_GETUSER:
+            register[ra] = user & 0x3F
 
-                op0 = get_register(token[1])
+        elif opcode == OP_IFEQ:
+            skip = not (register[ra] == register[0])
+        elif opcode == OP_IFNE:
+            skip = not (register[ra] != register[0])
+        elif opcode == OP_IFGE:
+            skip = not (register[ra] >= register[0])
+        elif opcode == OP_IFLT:
+            skip = not (register[ra] < register[0])
 
-                if token[0] == 'SETRGB':
-                    rgb[2] = register[op0] >> 4 & 0x3
-                    rgb[1] = register[op0] >> 2 & 0x3
-                    rgb[0] = register[op0] >> 0 & 0x3
-                if token[0] == 'SETR':
-                    rgb[2] = register[op0] & 0x3
-                if token[0] == 'SETG':
-                    rgb[1] = register[op0] & 0x3
-                if token[0] == 'SETB':
-                    rgb[0] = register[op0] & 0x3
-
-                if token[0] == 'GETX':
-                    register[op0] = x_pos & 0x3F
-                if token[0] == 'GETY':
-                    register[op0] = y_pos & 0x3F
-                if token[0] == 'GETTIME':
-                    register[op0] = time & 0x3F
-                if token[0] == 'GETUSER':
-                    register[op0] = user & 0x3F
-
-                if token[0] == 'IFEQ':
-                    skip = not (register[op0] == register[0])
-                if token[0] == 'IFNE':
-                    skip = not (register[op0] != register[0])
-                if token[0] == 'IFGE':
-                    skip = not (register[op0] >= register[0])
-                if token[0] == 'IFLT':
-                    skip = not (register[op0] < register[0])
-
-                if token[0] == 'DOUBLE':
-                    register[op0] = register[op0] << 1 & 0x3F
-                if token[0] == 'HALF':
-                    register[op0] = register[op0] >> 1 & 0x3F
-                if token[0] == 'CLEAR':
-                    register[op0] = 0
-    
-                if token[0] == 'SINE':
-                    if register[0] & (1<<4):
-                        register[op0] = sine_lut[15 - (register[0] & 0xF)]
-                    else:
-                        register[op0] = sine_lut[register[0] & 0xF]
-                    if verbose:
-                        print(f'register[0] {register[0]}')
+        elif opcode == OP_DOUBLE:
+            register[ra] = register[ra] << 1 & 0x3F
+        elif opcode == OP_HALF:
+            register[ra] = register[ra] >> 1
+        elif opcode == OP_CLEAR:
+            register[ra] = 0
 
+        elif opcode == OP_SINE:
+            if register[0] & (1<<4):
+                register[ra] = SINE_LUT[15 - (register[0] & 0xF)]
+            else:
+                register[ra] = SINE_LUT[register[0] & 0xF]
             if verbose:
-                print(f'Current state:')
-                print(f'register: {register}')
-                print(f'rgb: {rgb}')
-            
+                print(f'register[0] {register[0]}')
+
+        if verbose:
+            print(f'Executed {OPCODES[opcode]}')
+            print(f'register: {register}')
+            print(f'rgb: {rgb}')
+
+    return rgb
+
+def _statement(opcode, ra, rb, imm):
+    """Python statement for one decoded instruction"""
+
+    if opcode == OP_LDI:
+        return f'r0 = {imm}'
+
+    # AND, OR and MOV of a register with itself is a NOP
+    if opcode in (OP_AND, OP_OR, OP_MOV) and ra == rb:
+        return 'pass'
+
+    return {
+        OP_AND:     f'r{ra} = r{ra} & r{rb}',
+        OP_OR:      f'r{ra} = r{ra} | r{rb}',
+        OP_NOT:     f'r{ra} = ~r{rb} & 0x3F',
+        OP_XOR:     f'r{ra} = r{ra} ^ r{rb}',
+        OP_MOV:     f'r{ra} = r{rb}',
+        OP_ADD:     f'r{ra} = r{ra} + r{rb} & 0x3F',
+        OP_SHIFTL:  f'r{ra} = r{ra} << r{rb} & 0x3F',
+        OP_SHIFTR:  f'r{ra} = r{ra} >> r{rb}',
+        OP_SETRGB:  f'red = r{ra} >> 4 & 0x3; green = r{ra} >> 2 & 0x3; blue = r{ra} & 0x3',
+        OP_SETR:    f'red = r{ra} & 0x3',
+        OP_SETG:    f'green = r{ra} & 0x3',
+        OP_SETB:    f'blue = r{ra} & 0x3',
+        OP_GETX:    f'r{ra} = x_pos & 0x3F',
+        OP_GETY:    f'r{ra} = y_pos & 0x3F',
+        OP_GETTIME: f'r{ra} = time & 0x3F',
+        OP_GETUSER: f'r{ra} = user & 0x3F',
+        OP_DOUBLE:  f'r{ra} = r{ra} << 1 & 0x3F',
+        OP_HALF:    f'r{ra} = r{ra} >> 1',
+        OP_CLEAR:   f'r{ra} = 0',
+        OP_SINE:    f'r{ra} = SINE_LUT32[r0 & 0x1F]',
+    }[opcode]
+
+# Conditions of the branch instructions
+_CONDITIONS = {
+    OP_IFEQ: '==',
+    OP_IFNE: '!=',
+    OP_IFGE: '>=',
+    OP_IFLT: '<',
+}
+
+def generate(program):
+    """Generate straight-line Python source for the shader program
+
+    The registers live in locals and every instruction following
+    a branch is guarded by the condition of that branch.
+    """
+
+    if isinstance(program, str):
+        program = Program.from_source(program)
+
+    lines = [
+        f'def shader(x_pos, y_pos, time, user):',
+        f'    r0 = r1 = r2 = r3 = 0',
+        f'    red = green = blue = 0',
+    ]
+
+    # Condition guarding the current instruction
+    take = None
+
+    for index, (opcode, ra, rb, imm) in enumerate(program):
+        lines.append(f'    # {OPCODES[opcode]}')
+
+        if opcode in _CONDITIONS:
+            condition = f'r{ra} {_CONDITIONS[opcode]} r0'
+            # A skipped branch does not skip the next instruction
+            if take:
+                condition = f'{condition} if {take} else True'
+            take = f'take{index}'
+            lines.append(f'    {take} = {condition}')
         else:
-            print(f'Unknown instruction: {token[0]}')
-            sys.exit()
+            if take:
+                lines.append(f'    if {take}:')
+                lines.append(f'        {_statement(opcode, ra, rb, imm)}')
+            else:
+                lines.append(f'    {_statement(opcode, ra, rb, imm)}')
+            take = None
+
+    lines.append(f'    return [blue, green, red]')
+
+    return '\n'.join(lines) + '\n'
+
+@functools.lru_cache(maxsize=256)
+def compile_program(program):
+    """Compile the shader program into a function f(x_pos, y_pos, time, user)
+
+    The function returns the rgb channels in the same order as simulate().
+    Compiled functions are cached by program content.
+    """
+
+    if isinstance(program, str):
+        program = Program.from_source(program)
+
+    source = generate(program)
+
+    namespace = {'SINE_LUT32': SINE_LUT + SINE_LUT[::-1]}
+    exec(compile(source, f'<shader {program.digest()}>', 'exec'), namespace)
+
+    shader = namespace['shader']
+    shader.source = source
+
+    return shader
+
+# RGB222 channel value to RGB888 channel value
+COLOR_LUT = [0, 127, 128, 255]
+
+def expand_color(rgb):
+    """Expand the RGB222 result of simulate() into an RGB888 tuple"""
+    return (COLOR_LUT[rgb[2] & 0x3], COLOR_LUT[rgb[1] & 0x3], COLOR_LUT[rgb[0] & 0x3])
+
+def step_array(state, instruction, x_pos, y_pos, time=0, user=0):
+    """Execute one decoded instruction for many pixels at once
+
+    state is (register, rgb, skip), lists of arrays for the registers
+    and rgb channels and the skip mask. A new state is returned,
+    the given state is left unchanged.
+    """
+    import numpy as np
+
+    register, rgb, skip = list(state[0]), list(state[1]), state[2]
+    opcode, ra, rb, imm = instruction
+
+    # Pixels for which this instruction is executed
+    execute = ~skip
+    skip = np.zeros(execute.shape, dtype=bool)
+
+    # Pending writes as (destination, index, value)
+    writes = []
+
+    a = register[ra]
+    b = register[rb]
+
+    if opcode == OP_LDI:
+        writes.append((register, 0, imm))
+
+    elif opcode == OP_AND:
+        writes.append((register, ra, a & b))
+    elif opcode == OP_OR:
+        writes.append((register, ra, a | b))
+    elif opcode == OP_NOT:
+        writes.append((register, ra, ~b & 0x3F))
+    elif opcode == OP_XOR:
+        writes.append((register, ra, a ^ b))
+
+    elif opcode == OP_MOV:
+        writes.append((register, ra, b))
+    elif opcode == OP_ADD:
+        writes.append((register, ra, a + b & 0x3F))
+    # Shifting by six or more always clears the register
+    elif opcode == OP_SHIFTL:
+        writes.append((register, ra, a << np.minimum(b, 6) & 0x3F))
+    elif opcode == OP_SHIFTR:
+        writes.append((register, ra, a >> np.minimum(b, 6)))
+
+    elif opcode == OP_SETRGB:
+        writes.append((rgb, 2, a >> 4 & 0x3))
+        writes.append((rgb, 1, a >> 2 & 0x3))
+        writes.append((rgb, 0, a >> 0 & 0x3))
+    elif opcode == OP_SETR:
+        writes.append((rgb, 2, a & 0x3))
+    elif opcode == OP_SETG:
+        writes.append((rgb, 1, a & 0x3))
+    elif opcode == OP_SETB:
+        writes.append((rgb, 0, a & 0x3))
+
+    elif opcode == OP_GETX:
+        writes.append((register, ra, x_pos))
+    elif opcode == OP_GETY:
+        writes.append((register, ra, y_pos))
+    elif opcode == OP_GETTIME:
+        writes.append((register, ra, time))
+    elif opcode == OP_GETUSER:
+        writes.append((register, ra, user))
+
+    elif opcode == OP_IFEQ:
+        skip = execute & ~(a == register[0])
+    elif opcode == OP_IFNE:
+        skip = execute & ~(a != register[0])
+    elif opcode == OP_IFGE:
+        skip = execute & ~(a >= register[0])
+    elif opcode == OP_IFLT:
+        skip = execute & ~(a < register[0])
+
+    elif opcode == OP_DOUBLE:
+        writes.append((register, ra, a << 1 & 0x3F))
+    elif opcode == OP_HALF:
+        writes.append((register, ra, a >> 1))
+    elif opcode == OP_CLEAR:
+        writes.append((register, ra, 0))
+    elif opcode == OP_SINE:
+        # The sine LUT mirrored to 32 entries
+        sine_lut = np.array(SINE_LUT + SINE_LUT[::-1], dtype=np.uint8)
+        writes.append((register, ra, sine_lut[register[0] & 0x1F]))
+
+    # Only the executing pixels are updated
+    for dest, index, value in writes:
+        dest[index] = np.where(execute, value, dest[index]).astype(np.uint8)
+
+    return register, rgb, skip
+
+def simulate_array(program, x_pos, y_pos, time=0, user=0):
+    """Simulate the shader program for many pixels at once
+
+    The inputs can be NumPy arrays of any broadcastable shape,
+    every instruction is executed once for all of them.
+    Returns the rgb channels as arrays in the same order as simulate().
+    """
+    import numpy as np
+
+    if isinstance(program, str):
+        program = Program.from_source(program)
+
+    x_pos = np.asarray(x_pos, dtype=np.uint8) & 0x3F
+    y_pos = np.asarray(y_pos, dtype=np.uint8) & 0x3F
+    time = np.asarray(time, dtype=np.uint8) & 0x3F
+    user = np.asarray(user, dtype=np.uint8) & 0x3F
+
+    shape = np.broadcast_shapes(x_pos.shape, y_pos.shape, time.shape, user.shape)
+
+    state = (
+        [np.zeros(shape, dtype=np.uint8) for i in range(4)],
+        [np.zeros(shape, dtype=np.uint8) for i in range(3)],
+        np.zeros(shape, dtype=bool)
+    )
+
+    for instruction in program:
+        state = step_array(state, instruction, x_pos, y_pos, time, user)
+
+    return state[1]
+
+# Inputs a shader can read
+INPUTS = ('X', 'Y', 'TIME', 'USER')
+
+@functools.lru_cache(maxsize=256)
+def input_dependencies(program):
+    """Return the set of inputs that can reach the output color
+
+    Forward dataflow over the straight-line program. Each register
+    and color channel tracks the inputs its value depends on.
+    An instruction after a branch may or may not execute, so its
+    result also depends on the inputs of the branch condition.
+    """
+
+    if isinstance(program, str):
+        program = Program.from_source(program)
+
+    register = [frozenset() for i in range(4)]
+    rgb = [frozenset() for i in range(3)]
+
+    # Inputs deciding whether the next instruction is skipped,
+    # None if it is always executed
+    skip = None
+
+    for opcode, ra, rb, imm in program:
+
+        control = skip
+        skip = None
+
+        # Pending writes as (destination, index, dependencies)
+        writes = []
+
+        if opcode in _CONDITIONS:
+            skip = register[ra] | register[0] | (control or frozenset())
+            continue
+
+        if opcode == OP_LDI:
+            writes.append((register, 0, frozenset()))
+        elif opcode in (OP_AND, OP_OR, OP_XOR, OP_ADD, OP_SHIFTL, OP_SHIFTR):
+            writes.append((register, ra, register[ra] | register[rb]))
+        elif opcode in (OP_NOT, OP_MOV):
+            writes.append((register, ra, register[rb]))
+
+        elif opcode == OP_SETRGB:
+            writes.extend([(rgb, 2, register[ra]), (rgb, 1, register[ra]), (rgb, 0, register[ra])])
+        elif opcode == OP_SETR:
+            writes.append((rgb, 2, register[ra]))
+        elif opcode == OP_SETG:
+            writes.append((rgb, 1, register[ra]))
+        elif opcode == OP_SETB:
+            writes.append((rgb, 0, register[ra]))
+
+        elif opcode == OP_GETX:
+            writes.append((register, ra, frozenset(['X'])))
+        elif opcode == OP_GETY:
+            writes.append((register, ra, frozenset(['Y'])))
+        elif opcode == OP_GETTIME:
+            writes.append((register, ra, frozenset(['TIME'])))
+        elif opcode == OP_GETUSER:
+            writes.append((register, ra, frozenset(['USER'])))
+
+        elif opcode in (OP_DOUBLE, OP_HALF):
+            writes.append((register, ra, register[ra]))
+        elif opcode == OP_CLEAR:
+            writes.append((register, ra, frozenset()))
+        elif opcode == OP_SINE:
+            writes.append((register, ra, register[0]))
+
+        for dest, index, deps in writes:
+            if control is None:
+                dest[index] = deps
+            else:
+                # Either the old or the new value
+                dest[index] = dest[index] | deps | control
+
+    return rgb[0] | rgb[1] | rgb[2]
+
+def render_rrggbb(program, time=0, user=0, width=64, height=48):
+    """Render whole frames, returns the 6-bit rrggbb value of each pixel
+
+    time and user can be arrays, the result has their broadcast
+    shape followed by (height, width).
+    """
+    import numpy as np
+
+    if isinstance(program, str):
+        program = Program.from_source(program)
+
+    # Only evaluate the inputs the shader actually reads,
+    # the result is broadcast to the whole frame
+    inputs = input_dependencies(program)
+
+    x_pos = np.arange(width) if 'X' in inputs else np.zeros(1)
+    y_pos = np.arange(height)[:, np.newaxis] if 'Y' in inputs else np.zeros((1, 1))
+
+    time = np.asarray(time)[..., np.newaxis, np.newaxis]
+    user = np.asarray(user)[..., np.newaxis, np.newaxis]
+
+    rgb = simulate_array(program, x_pos, y_pos, time, user)
+
+    shape = np.broadcast_shapes(time.shape[:-2], user.shape[:-2]) + (height, width)
+
+    return np.broadcast_to(rgb[2] << 4 | rgb[1] << 2 | rgb[0], shape)
+
+def expand_rrggbb(rrggbb):
+    """Expand rrggbb values to RGB888, adds a last axis with the three channels"""
+    import numpy as np
+
+    color_lut = np.array([expand_color([c & 0x3, c >> 2 & 0x3, c >> 4 & 0x3]) for c in range(64)], dtype=np.uint8)
+
+    return color_lut[rrggbb]
+
+def render_frame(program, time=0, user=0, width=64, height=48):
+    """Render a whole frame, returns an RGB888 array of shape (height, width, 3)"""
+    return expand_rrggbb(render_rrggbb(program, time, user, width, height))
+
+def render_image(program, time=0, user=0, engine='compiled', verbose=False):
+    """Render one frame with the compiled or simulate engine, returns a PIL image"""
+    from PIL import Image
+
+    WIDTH = 640//NUM_INSTR
+    HEIGHT = 480//NUM_INSTR
+
+    img = Image.new(mode="RGB", size=(WIDTH, HEIGHT))
+    pixels = img.load()
+
+    if engine == 'compiled':
+        shader_function = compile_program(program)
+
+        for y_pos in range(HEIGHT):
+            for x_pos in range(WIDTH):
+                pixels[x_pos,y_pos] = expand_color(shader_function(x_pos, y_pos, time, user))
+    else:
+        for y_pos in range(HEIGHT):
+            for x_pos in range(WIDTH):
+                rgb = simulate(program, x_pos, y_pos, time=time, user=user, verbose=verbose)
+                pixels[x_pos,y_pos] = expand_color(rgb)
+
+    return img
+
+def assemble_bit(shader, verbose=False):
+    """Assemble a shader into the contents of a .bit file, filled up with nops"""
+    assembled = assemble(shader, verbose)
+    
+    # Fill up with nops
+    while len(assembled) < NUM_INSTR:
+        assembled.append('01_00_00_00 // NOP')
+    
+    if len(assembled) > NUM_INSTR:
+        print('Error: Too many instruction!')
+    
+    return '\n'.join(assembled)
+
+def write_golden(paths, output, user=42):
+    """Write the rrggbb frames of the shaders into one .npz for the tests
+
+    For each shader, the frames of all 64 time steps are stored at the
+    native resolution, or a single frame if the shader never reads TIME.
+    name_digest holds the SHA-1 of each frame. The file is only written
+    if a frame changed.
+    """
+    import numpy as np
+    
+    arrays = {}
+    
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        program = Program.from_file(path)
         
-    return rgb
+        times = np.arange(64) if 'TIME' in input_dependencies(program) else np.zeros(1, dtype=np.uint8)
+        frames = np.ascontiguousarray(render_rrggbb(program, times, user))
+        
+        arrays[name] = frames
+        arrays[f'{name}_digest'] = np.array([hashlib.sha1(frame.tobytes()).hexdigest() for frame in frames])
+    
+    # The archive differs for each write, keep it unless a frame changed
+    if os.path.exists(output):
+        with np.load(output) as golden:
+            if set(golden.files) == set(arrays) and all(np.array_equal(golden[key], value) for key, value in arrays.items()):
+                return
+    
+    np.savez_compressed(output, **arrays)
+
+MANIFEST = '.manifest'
+
+def assembler_hash():
+    """Content hash of the assembler itself, a change rebuilds all shaders"""
+    with open(__file__, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def build_shader(shader_path, bit_path, image_path=None):
+    """Assemble a single shader and render its first frame"""
+    with open(shader_path, 'r') as f:
+        shader = f.read()
+    
+    with open(bit_path, 'w') as f:
+        f.write(assemble_bit(shader))
+    
+    if image_path:
+        program = Program.from_source(shader)
+        
+        try:
+            from PIL import Image
+            img = Image.fromarray(render_frame(program, time=0, user=42))
+        except ImportError:
+            img = render_image(program, time=0, user=42, engine='compiled')
+        
+        img.save(image_path)
+
+def build_all(shader_dir, bit_dir, image_dir=None, jobs=None, force=False, verbose=False):
+    """Assemble and render all shaders of a directory with a pool of workers
+
+    A manifest in bit_dir records the content hash of each shader
+    and of the assembler, only shaders where either changed are
+    rebuilt. Returns the number of failed shaders.
+    """
+    import json
+    from concurrent.futures import ProcessPoolExecutor
+    
+    manifest_path = os.path.join(bit_dir, MANIFEST)
+    
+    manifest = {'assembler': None, 'shaders': {}}
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    
+    # Everything is outdated if the assembler changed
+    version = assembler_hash()
+    if manifest['assembler'] != version:
+        manifest = {'assembler': version, 'shaders': {}}
+    
+    shaders = {}
+    builds = {}
+    
+    for filename in sorted(os.listdir(shader_dir)):
+        name, extension = os.path.splitext(filename)
+        
+        if extension != '.shader':
+            continue
+        
+        shader_path = os.path.join(shader_dir, filename)
+        bit_path = os.path.join(bit_dir, name + '.bit')
+        image_path = os.path.join(image_dir, name + '.png') if image_dir else None
+        
+        with open(shader_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        
+        outputs = [bit_path] + ([image_path] if image_path else [])
+        
+        if manifest['shaders'].get(name) == digest and all(os.path.exists(path) for path in outputs):
+            shaders[name] = digest
+            continue
+        
+        builds[name] = (digest, (shader_path, bit_path, image_path))
+    
+    failed = 0
+    
+    if builds:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {name: executor.submit(build_shader, *paths) for name, (digest, paths) in builds.items()}
+            
+            for name, future in futures.items():
+                # The assembler exits on invalid shaders
+                try:
+                    future.result()
+                except (Exception, SystemExit) as e:
+                    print(f'Error: {name}: {e or "invalid shader"}')
+                    failed += 1
+                    continue
+                
+                shaders[name] = builds[name][0]
+                
+                if verbose:
+                    print(f'Built {name}')
+    
+    # Removed shaders are dropped from the manifest
+    manifest['shaders'] = shaders
+    
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    
+    print(f'{len(builds) - failed} built, {failed} failed, {len(shaders) - len(builds) + failed} up to date')
+    
+    return failed
 
 def main():
     parser = argparse.ArgumentParser()
@@ -278,13 +908,72 @@ def main():
     parser.add_argument('-v', '--verbose', help='verbose output', action='store_true')
     parser.add_argument('-s', '--summary', help='summary about all instructions', action='store_true')
     parser.add_argument('-t', '--time', help='simulate for t timesteps', default=1, type=int)
+    parser.add_argument('--animation', help='encode all timesteps into an animated .gif or .png', type=str, required=False)
+    parser.add_argument('--stream', help='write all timesteps as raw RGB or y4m frames to stdout', choices=['rgb', 'y4m'], required=False)
+    parser.add_argument('--scale', help='upscale the output by an integer factor, 10 gives the VGA resolution', default=1, type=int)
+    parser.add_argument('--fps', help='frame rate of the animation', default=7.5, type=float)
+    parser.add_argument('-u', '--user', help='value of the user register', default=42, type=int)
+    parser.add_argument('--count', help='sweep the user register from 0 to 63 instead of the time', action='store_true')
+    parser.add_argument('--cache', help='directory to store precomputed frames', type=str, required=False)
+    parser.add_argument('--cube', help='precompute all time and user combinations', action='store_true')
+    parser.add_argument('--batch', help='-i, -o and --image are directories, only changed shaders are rebuilt', action='store_true')
+    parser.add_argument('-j', '--jobs', help='number of worker processes for --batch', type=int, required=False)
+    parser.add_argument('--force', help='rebuild all shaders with --batch', action='store_true')
+    parser.add_argument('--pack', help='write all .bit files of the --batch output directory into a shader pack', type=str, required=False)
+    parser.add_argument('--golden', help='write the frames of all .bit files of the --batch output directory into a .npz', type=str, required=False)
+    parser.add_argument('-d', '--disassemble', help='print the shader source of a .bit file, a shader pack or raw instruction bytes', type=str, required=False)
+    parser.add_argument('-e', '--engine', help='simulation engine, numpy renders the whole frame at once, compiled generates Python code per shader', choices=['numpy', 'compiled', 'simulate'], required=False)
     
     args = parser.parse_args()
     
+    # The frames are written to stdout, the verbose output would corrupt them
+    if args.stream and args.verbose:
+        parser.error('--verbose can not be used with --stream')
+    
     if args.summary:
         summary()
         return
     
+    if args.disassemble:
+        if args.disassemble.endswith('.bit'):
+            print(disassemble(Program.from_file(args.disassemble).words), end='')
+        else:
+            with open(args.disassemble, 'rb') as f:
+                data = f.read()
+            
+            import shaderpack
+            
+            if data.startswith(shaderpack.MAGIC):
+                for name, words in shaderpack.ShaderPack(data):
+                    print(f'# {name}')
+                    print(disassemble(words))
+            else:
+                print(disassemble(data), end='')
+        return
+    
+    if args.batch:
+        if not args.input:
+            parser.error('--batch requires -i with a shader directory')
+        
+        os.makedirs(args.output, exist_ok=True)
+        if args.image:
+            os.makedirs(args.image, exist_ok=True)
+        
+        failed = build_all(args.input, args.output, args.image, args.jobs, args.force, args.verbose)
+        
+        bits = sorted(os.path.join(args.output, filename) for filename in os.listdir(args.output) if filename.endswith('.bit'))
+        
+        if args.pack:
+            import shaderpack
+            shaderpack.pack_files(bits, args.pack)
+        
+        if args.golden:
+            write_golden(bits, args.golden)
+        
+        if failed:
+            sys.exit(1)
+        return
+    
     if not args.input:
         shader = """
         # Example Shader
@@ -302,65 +991,105 @@ def main():
         SETRGB R2
         """
     
-        print('No input specfified! Using example shader:')
-        print(program)
+        log = sys.stderr if args.stream else sys.stdout
+        print('No input specfified! Using example shader:', file=log)
+        print(shader, file=log)
     
     else:
         with open(args.input, 'r') as f:
             shader = f.read()
     
-    NUM_INSTR = 10
+    if args.image or args.animation or args.stream:
     
-    if args.image:
+        # Decode the shader only once
+        program = Program.from_source(shader)
+    
+        engine = args.engine
+        
+        # Prefer the vectorized engine if NumPy is available
+        if not engine:
+            engine = 'numpy' if importlib.util.find_spec('numpy') else 'compiled'
     
-        for time in range(args.time):
+        WIDTH = 640//NUM_INSTR
+        HEIGHT = 480//NUM_INSTR
+        
+        # Inputs for each frame
+        if args.count:
+            # Same as the count action of the bring-up script
+            steps = [(0, user) for user in range(64)]
+        else:
+            steps = [(time, args.user) for time in range(args.time)]
+        
+        # Frames only differ if TIME or USER is read, both wrap after 64 steps
+        inputs = input_dependencies(program)
+        
+        if args.count and not 'USER' in inputs:
+            print(f'USER is never read, all {len(steps)} frames are identical', file=sys.stderr)
+        elif len(steps) > 1 and not args.count and not 'TIME' in inputs:
+            print(f'TIME is never read, all {len(steps)} frames are identical', file=sys.stderr)
+        elif args.time > 64:
+            print('TIME wraps after 64 timesteps, frame t is identical to frame t % 64', file=sys.stderr)
+        
+        if engine == 'numpy':
+            import framecache
+            
+            cache = framecache.FrameCache(directory=args.cache, width=WIDTH, height=HEIGHT)
+            
+            if args.cube:
+                cache.precompute(program)
+        
+        from PIL import Image
+        
+        # Frames are encoded as they are rendered
+        writer = None
+        
+        # Upscaling and encoding work on NumPy arrays
+        if args.scale > 1 or args.animation or args.stream:
+            import numpy
+            import animation
+            
+            if args.animation:
+                writer = animation.open_animation(args.animation, WIDTH*args.scale, HEIGHT*args.scale, args.fps, len(steps))
+            elif args.stream:
+                writer = animation.open_stream(args.stream, WIDTH*args.scale, HEIGHT*args.scale, args.fps)
+        
+        rendered = {}
     
-            WIDTH = 640//NUM_INSTR
-            HEIGHT = 480//NUM_INSTR
+        for index, (time, user) in enumerate(steps):
             
-            from PIL import Image
+            key = (time & 0x3F if 'TIME' in inputs else 0, user & 0x3F if 'USER' in inputs else 0)
             
-            img = Image.new(mode="RGB", size=(WIDTH, HEIGHT))
-            pixels = img.load()
+            if engine == 'numpy':
+                img = Image.fromarray(expand_rrggbb(cache.get(program, time, user)))
+            elif key in rendered:
+                img = rendered[key]
+            else:
+                img = render_image(program, time, user, engine, args.verbose)
+                
+                rendered[key] = img
             
-            for y_pos in range(HEIGHT):
-                for x_pos in range(WIDTH):
-                    rgb = simulate(shader, x_pos, y_pos, time=time, user=42, verbose=args.verbose)
-                    
-                    if args.verbose:
-                        #print(rgb)
-                        pass
-                    
-                    red = (rgb[2]&0x3)<<6
-                    if rgb[2] & 0x1:
-                        red |= 63
-                    
-                    green = (rgb[1]&0x3)<<6
-                    if rgb[1] & 0x1:
-                        green |= 63
-                    
-                    blue = (rgb[0]&0x3)<<6
-                    if rgb[0] & 0x1:
-                        blue |= 63
-                    
-                    pixels[x_pos,y_pos] = (red, green, blue)
+            if args.scale > 1 or writer:
+                frame = animation.upscale(numpy.asarray(img), args.scale)
+                
+                if writer:
+                    writer.write(frame)
+                
+                img = Image.fromarray(frame)
                     
             #img.show()
-            if args.time == 1:
-                img.save(f'{args.image}')
-            else:
-                img.save(f'{os.path.splitext(args.image)[0]}_{time:02d}.png')
+            if args.image:
+                if len(steps) == 1:
+                    img.save(f'{args.image}')
+                else:
+                    img.save(f'{os.path.splitext(args.image)[0]}_{index:02d}.png')
+        
+        if writer:
+            writer.close()
+        
+        if args.verbose and engine == 'numpy':
+            print(f'Frame cache: {cache.hits} hits, {cache.misses} misses')
 
-    assembled = assemble(shader, args.verbose)
-    
-    # Fill up with nops
-    while len(assembled) < NUM_INSTR:
-        assembled.append('01_00_00_00 // NOP')
-    
-    if len(assembled) > NUM_INSTR:
-        print('Error: Too many instruction!')
-    
-    assembled = '\n'.join(assembled)
+    assembled = assemble_bit(shader, args.verbose)
     
     if args.verbose:
         print(assembled)
@@ -0,0 +1,154 @@
+import os
+import argparse
+import itertools
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from assembler import Program, NOP_WORD, DECODE_TABLE
+from hwmodel import TinyShaderTop, GEOMETRIES
+from shaderpack import natural_key
+
+def word_bins(word):
+    """Bins an executed instruction can hit, without the branch outcome
+
+    ('opcode', name), ('ra', name, register) and ('rb', name, register)
+    """
+    name, fmt, ra, rb, imm = DECODE_TABLE[word]
+
+    bins = [('opcode', name)]
+
+    if ra is not None:
+        bins.append(('ra', name, ra))
+    if rb is not None:
+        bins.append(('rb', name, rb))
+
+    return bins
+
+def all_bins():
+    """The full coverage space, NOP is not an instruction of its own"""
+    bins = set()
+
+    for word in range(256):
+        if word == NOP_WORD:
+            continue
+
+        bins.update(word_bins(word))
+
+        name = DECODE_TABLE[word][0]
+        if name.startswith('IF'):
+            bins.add(('branch', name, 'taken'))
+            bins.add(('branch', name, 'not taken'))
+
+    return bins
+
+class CoverageModel(TinyShaderTop):
+    """The cycle-level model, counting the bins of each executed instruction
+
+    Skipped instructions are not counted. A branch is taken if the
+    following instruction is executed. Only frame_clocked() samples
+    coverage, frame() does not call execute().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hits = Counter()
+
+    def execute(self, word):
+        skipped = self.skip
+
+        super().execute(word)
+
+        if skipped or word == NOP_WORD:
+            return
+
+        self.hits.update(word_bins(word))
+
+        name = DECODE_TABLE[word][0]
+        if name.startswith('IF'):
+            self.hits[('branch', name, 'not taken' if self.skip else 'taken')] += 1
+
+def collect(path, frames=1, user=42, geometry='vga'):
+    """Coverage of a shader in the first frames after reset
+
+    The default is the same as in test_vga_load.
+    """
+    model = CoverageModel(GEOMETRIES[geometry])
+    model.load(Program.from_file(path))
+    model.set_user(user)
+
+    for i in range(frames):
+        model.frame_clocked()
+
+    return model.hits
+
+def select(coverage):
+    """Select the smallest set of shaders that hits all bins hit by any shader
+
+    Greedy set cover gives an upper bound: the shader that hits the
+    most missing bins is added first. Smaller sets are then searched
+    exhaustively, which is affordable for the dozen shaders of the
+    repository. Returns the names, those that hit more bins first.
+    """
+    covered = set().union(*coverage.values())
+    names = sorted(coverage, key=lambda name: len(coverage[name]), reverse=True)
+
+    missing = set(covered)
+    selected = []
+
+    while missing:
+        name = max(names, key=lambda name: len(coverage[name] & missing))
+        selected.append(name)
+        missing -= coverage[name]
+
+    for size in range(1, len(selected)):
+        for subset in itertools.combinations(names, size):
+            if set().union(*(coverage[name] for name in subset)) == covered:
+                return list(subset)
+
+    return selected
+
+def format_bin(key):
+    return ' '.join(f'R{part}' if isinstance(part, int) else part for part in key[1:]) + f' ({key[0]})'
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect instruction coverage and select the smallest regression set')
+    parser.add_argument('inputs', help='.bit or .shader files', nargs='+')
+    parser.add_argument('-o', '--output', help='write the names of the selected shaders', type=str, required=False)
+    parser.add_argument('-f', '--frames', help='number of frames after reset', default=1, type=int)
+    parser.add_argument('-u', '--user', help='value of the user register', default=42, type=int)
+    parser.add_argument('-g', '--geometry', help='timing of the design', choices=GEOMETRIES, default='vga')
+    parser.add_argument('-j', '--jobs', help='number of worker processes', type=int, required=False)
+    parser.add_argument('-v', '--verbose', help='list the bins that are not hit', action='store_true')
+
+    args = parser.parse_args()
+
+    paths = sorted(args.inputs, key=natural_key)
+    names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(collect, path, args.frames, args.user, args.geometry) for path in paths]
+        coverage = {name: set(future.result()) for name, future in zip(names, futures)}
+
+    space = all_bins()
+    covered = set().union(*coverage.values())
+
+    for name in names:
+        print(f'{name:16} {len(coverage[name]):4} bins {100 * len(coverage[name]) / len(space):5.1f} %')
+
+    print(f'{"all":16} {len(covered):4} bins {100 * len(covered) / len(space):5.1f} %')
+
+    if args.verbose:
+        for key in sorted(space - covered):
+            print(f'  not hit: {format_bin(key)}')
+
+    selected = select(coverage)
+    print(f'Selected {len(selected)} of {len(names)} shaders: {" ".join(selected)}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write('# Smallest set of shaders with the coverage of all, generated by sw/coverage.py\n')
+            for name in selected:
+                f.write(f'{name}\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from assembler import Program, input_dependencies, render_rrggbb
+
+class FrameCache:
+    """Cache of rendered frames
+
+    Frames are keyed by the content hash of the program, the frame
+    size and the (time, user) inputs. TIME and USER are 6-bit, so a shader has
+    at most 64x64 distinct frames. Inputs the shader never reads
+    are left out of the key, so e.g. all time steps of a static
+    shader share one entry.
+
+    Single frames are kept in a bounded LRU. precompute() renders
+    the full (time, user) cube of a program at once, which is
+    stored as .npy in the optional directory and memory-mapped.
+    Frames are 6-bit rrggbb values of shape (height, width).
+    """
+
+    def __init__(self, max_frames=1024, directory=None, width=64, height=48):
+        self.max_frames = max_frames
+        self.directory = directory
+        self.width = width
+        self.height = height
+
+        self.frames = OrderedDict()
+        self.cubes = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, program, time, user):
+        """Cache key with the unused inputs set to zero"""
+        inputs = input_dependencies(program)
+
+        time = time & 0x3F if 'TIME' in inputs else 0
+        user = user & 0x3F if 'USER' in inputs else 0
+
+        return self.cube_key(program) + (time, user)
+
+    def cube_key(self, program):
+        """Key of the cube in memory, the same as its name on disk"""
+        return (program.digest(), self.width, self.height)
+
+    def cube_path(self, program):
+        return os.path.join(self.directory, '{}_{}x{}.npy'.format(*self.cube_key(program)))
+
+    def cube(self, program):
+        """Return the precomputed cube of the program, if any"""
+        key = self.cube_key(program)
+
+        if key in self.cubes:
+            return self.cubes[key]
+
+        if self.directory and os.path.exists(self.cube_path(program)):
+            self.cubes[key] = np.load(self.cube_path(program), mmap_mode='r')
+            return self.cubes[key]
+
+        return None
+
+    def precompute(self, program):
+        """Render every (time, user) combination of the program once
+
+        The cube has the shape (time, user, height, width), with
+        a size of one along the inputs the shader does not read.
+        """
+        cube = self.cube(program)
+
+        if cube is not None:
+            return cube
+
+        inputs = input_dependencies(program)
+
+        num_time = 64 if 'TIME' in inputs else 1
+        num_user = 64 if 'USER' in inputs else 1
+
+        shape = (num_time, num_user, self.height, self.width)
+
+        if self.directory:
+            # Write to a temporary file first, an interrupted run leaves no broken cube
+            path = self.cube_path(program)
+            cube = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.uint8, shape=shape)
+        else:
+            cube = np.empty(shape, dtype=np.uint8)
+
+        # One time step at a time to bound the memory
+        for time in range(num_time):
+            cube[time] = render_rrggbb(program, time, np.arange(num_user), self.width, self.height)
+
+        if self.directory:
+            cube.flush()
+            del cube
+            os.replace(path + '.tmp', path)
+            cube = np.load(path, mmap_mode='r')
+
+        self.cubes[self.cube_key(program)] = cube
+
+        return cube
+
+    def get(self, program, time=0, user=0):
+        """Return the rrggbb frame for the given inputs, rendering it on a miss"""
+        if isinstance(program, str):
+            program = Program.from_source(program)
+
+        key = self.key(program, time, user)
+        time, user = key[-2:]
+
+        if key in self.frames:
+            self.hits += 1
+            self.frames.move_to_end(key)
+            return self.frames[key]
+
+        cube = self.cube(program)
+
+        if cube is not None:
+            self.hits += 1
+            return cube[time, user]
+
+        self.misses += 1
+
+        frame = render_rrggbb(program, time, user, self.width, self.height)
+
+        self.frames[key] = frame
+        if len(self.frames) > self.max_frames:
+            self.frames.popitem(last=False)
+
+        return frame
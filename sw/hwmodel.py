@@ -0,0 +1,462 @@
+import os
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from assembler import (Program, NUM_INSTR, NOP_WORD, SINE_LUT, OPCODES, decode, expand_rrggbb,
+    OP_SETRGB, OP_SETR, OP_SETG, OP_SETB, OP_GETX, OP_GETY, OP_GETTIME, OP_GETUSER,
+    OP_IFEQ, OP_IFNE, OP_IFGE, OP_IFLT, OP_DOUBLE, OP_HALF, OP_CLEAR, OP_SINE,
+    OP_AND, OP_OR, OP_NOT, OP_XOR, OP_MOV, OP_ADD, OP_SHIFTL, OP_SHIFTR, OP_LDI)
+
+# Horizontal and vertical timing, same as tiny_shader_top.sv
+Geometry = namedtuple('Geometry', ['width', 'height', 'hfront', 'hsync', 'hback', 'vfront', 'vsync', 'vback'])
+
+# VGA 640x480 @ 60 Hz
+VGA = Geometry(640, 480, 16, 96, 48, 10, 2, 33)
+
+# Reduced geometry for faster simulations, SMALL_GEOMETRY in tt_um_tiny_shader_mole99.sv
+# The vertical blanking is still long enough to load a shader over SPI at 2 MHz
+SMALL = Geometry(160, 120, 4, 24, 12, 2, 2, 30)
+
+GEOMETRIES = {'vga': VGA, 'small': SMALL}
+
+# Default program after reset (test4)
+DEFAULT_PROGRAM = [
+    0b00_0100_00, # GETX R0
+    0b00_0101_01, # GETY R1
+    0b01_11_01_00, # XOR R0 R1
+    0b00_0110_10, # GETTIME R2
+    0b10_01_10_00, # ADD R0 R2
+    0b00_0000_00, # SETRGB R0
+    NOP_WORD,
+    NOP_WORD,
+    NOP_WORD,
+    NOP_WORD,
+]
+
+def clog2(value):
+    """Same as $clog2"""
+    return (value - 1).bit_length()
+
+class TinyShaderTop:
+    """Cycle-level model of tiny_shader_top
+
+    clock() advances the model by one clock cycle and follows
+    the RTL register by register. frame() produces the same
+    result, but executes the shader for all pixels of a frame
+    directly, using a generated Python function per line.
+
+    Like the hardware, the registers, the color and the skip flag
+    persist across pixels, lines and frames. Every line of the
+    10x10 pixel blocks executes the shader again.
+    Frames are returned as 6-bit rrggbb values of shape (height, width).
+    """
+
+    def __init__(self, geometry=VGA, num_instr=NUM_INSTR):
+        self.geometry = geometry
+        self.num_instr = num_instr
+
+        assert geometry.width % num_instr == 0 and geometry.height % num_instr == 0
+        assert geometry.hfront + geometry.hsync + geometry.hback >= num_instr
+
+        self.h_start = -(geometry.hfront + geometry.hsync + geometry.hback)
+        self.v_start = -(geometry.vfront + geometry.vsync + geometry.vback)
+
+        self.x_mask = (1 << clog2(geometry.width // num_instr)) - 1
+        self.y_mask = (1 << clog2(geometry.height // num_instr)) - 1
+
+        self.lines = {}
+
+        self.reset()
+
+    def reset(self):
+        """Reset all registers"""
+
+        # timing
+        self.counter_h = self.h_start
+        self.counter_v = self.v_start
+
+        # cur_time counter, wraps at 512 frames
+        self.cur_time = 0
+        self.time_dir = 0
+
+        # spi_receiver
+        self.user = 42
+
+        # shader_memory, memory[i] is memory[(pointer + i) % num_instr]
+        self.memory = list(DEFAULT_PROGRAM)
+        self.pointer = 0
+
+        # Sub positions and positions
+        self.x_subpos = 0
+        self.y_subpos = 0
+        self.x_pos = 0
+        self.y_pos = 0
+
+        # shader_execute
+        self.regs = [0, 0, 0, 0]
+        self.rgb = 0
+        self.skip = False
+
+        # Output
+        self.capture = False
+        self.rgb_d = 0
+        self.hsync_o = 1
+        self.vsync_o = 1
+
+        # Not in the RTL, the counters delayed like the outputs
+        self.out_h = self.counter_h
+        self.out_v = self.counter_v
+
+    @property
+    def time(self):
+        """The time as seen by the shader"""
+        return self.cur_time >> 3
+
+    def shift(self, word=None):
+        """Shift the shader memory, loading a new word if given"""
+        if word is not None:
+            self.memory[self.pointer] = word
+        self.pointer = (self.pointer + 1) % self.num_instr
+
+    def load(self, words):
+        """Shift in new instructions as the SPI receiver does in data mode"""
+        if isinstance(words, Program):
+            words = words.words
+
+        for word in words:
+            self.shift(word)
+
+    def instructions(self):
+        """Current contents of the shader memory, memory[0] first"""
+        return [self.memory[(self.pointer + i) % self.num_instr] for i in range(self.num_instr)]
+
+    def set_user(self, value):
+        """Set the user register as the SPI receiver does in command mode"""
+        self.user = value & 0x3F
+
+    def next_time(self):
+        """Advance cur_time on next_frame
+
+        &(cur_time+1) is evaluated with 32 bits and is never all ones,
+        so time_dir stays 0 and cur_time wraps from 511 to 0.
+        """
+        if self.time_dir == 0:
+            if (self.cur_time + 1) & 0xFFFFFFFF == 0xFFFFFFFF:
+                self.time_dir = 1
+            self.cur_time = (self.cur_time + 1) & 0x1FF
+        else:
+            if self.cur_time == 1:
+                self.time_dir = 0
+            self.cur_time = self.cur_time - 1
+
+    def execute(self, word):
+        """Execute one instruction as shader_execute does"""
+        if self.skip:
+            self.skip = False
+            return
+
+        opcode, ra, rb, imm = decode(word)
+        regs = self.regs
+
+        if opcode == OP_SETRGB:
+            self.rgb = regs[ra]
+        elif opcode == OP_SETR:
+            self.rgb = self.rgb & 0b00_11_11 | (regs[ra] & 0x3) << 4
+        elif opcode == OP_SETG:
+            self.rgb = self.rgb & 0b11_00_11 | (regs[ra] & 0x3) << 2
+        elif opcode == OP_SETB:
+            self.rgb = self.rgb & 0b11_11_00 | (regs[ra] & 0x3)
+
+        elif opcode == OP_GETX:
+            regs[ra] = self.x_pos
+        elif opcode == OP_GETY:
+            regs[ra] = self.y_pos
+        elif opcode == OP_GETTIME:
+            regs[ra] = self.time
+        elif opcode == OP_GETUSER:
+            regs[ra] = self.user
+
+        elif opcode == OP_IFEQ:
+            self.skip = not (regs[ra] == regs[0])
+        elif opcode == OP_IFNE:
+            self.skip = not (regs[ra] != regs[0])
+        elif opcode == OP_IFGE:
+            self.skip = not (regs[ra] >= regs[0])
+        elif opcode == OP_IFLT:
+            self.skip = not (regs[ra] < regs[0])
+
+        elif opcode == OP_DOUBLE:
+            regs[ra] = regs[ra] << 1 & 0x3F
+        elif opcode == OP_HALF:
+            regs[ra] = regs[ra] >> 1
+        elif opcode == OP_CLEAR:
+            regs[ra] = 0
+        elif opcode == OP_SINE:
+            if regs[0] & (1<<4):
+                regs[ra] = SINE_LUT[15 - (regs[0] & 0xF)]
+            else:
+                regs[ra] = SINE_LUT[regs[0] & 0xF]
+
+        elif opcode == OP_AND:
+            regs[ra] = regs[ra] & regs[rb]
+        elif opcode == OP_OR:
+            regs[ra] = regs[ra] | regs[rb]
+        elif opcode == OP_NOT:
+            regs[ra] = ~regs[rb] & 0x3F
+        elif opcode == OP_XOR:
+            regs[ra] = regs[ra] ^ regs[rb]
+
+        elif opcode == OP_MOV:
+            regs[ra] = regs[rb]
+        elif opcode == OP_ADD:
+            regs[ra] = regs[ra] + regs[rb] & 0x3F
+        elif opcode == OP_SHIFTL:
+            regs[ra] = regs[ra] << regs[rb] & 0x3F
+        elif opcode == OP_SHIFTR:
+            regs[ra] = regs[ra] >> regs[rb]
+
+        elif opcode == OP_LDI:
+            regs[0] = imm
+
+    def clock(self):
+        """Advance the model by one clock cycle"""
+        g = self.geometry
+        n = self.num_instr
+
+        # Combinational signals of the current cycle
+        next_vertical = self.counter_h >= g.width - 1
+        next_frame = self.counter_v >= g.height - 1 and next_vertical
+
+        hsync = not (-g.hsync - g.hback <= self.counter_h < -g.hback)
+        vsync = not (-g.vsync - g.vback <= self.counter_v < -g.vback)
+
+        hblank = self.counter_h < 0
+        vblank = self.counter_v < 0
+
+        execute_shader_y = 0 <= self.counter_v < g.height
+        execute_shader_x = 0 <= self.counter_h + n < g.width and execute_shader_y
+
+        # Output color, before the shader updates rgb
+        rgb_d = self.rgb if self.capture else self.rgb_d
+        if hblank or vblank:
+            rgb_d = 0
+
+        capture = self.x_subpos == n-1
+
+        # Shader execution
+        if execute_shader_x:
+            self.execute(self.memory[self.pointer])
+
+        # Shader memory
+        if execute_shader_x or self.x_subpos > 0:
+            self.shift()
+
+        # Positions
+        x_pos = self.x_pos
+        y_pos = self.y_pos
+
+        if self.x_subpos == n-1:
+            x_pos = (x_pos + 1) & self.x_mask
+
+        if next_vertical:
+            x_pos = 0
+            if self.y_subpos == n-1:
+                y_pos = (y_pos + 1) & self.y_mask
+
+        if next_frame:
+            y_pos = 0
+
+        # Sub positions
+        if execute_shader_x or self.x_subpos > 0:
+            self.x_subpos = 0 if self.x_subpos == n-1 else self.x_subpos + 1
+
+        if execute_shader_y and next_vertical:
+            self.y_subpos = 0 if self.y_subpos == n-1 else self.y_subpos + 1
+
+        # Time
+        if next_frame:
+            self.next_time()
+
+        # Delayed outputs
+        self.out_h = self.counter_h
+        self.out_v = self.counter_v
+        self.hsync_o = hsync
+        self.vsync_o = vsync
+
+        # Counters
+        if next_vertical:
+            self.counter_h = self.h_start
+            if next_frame:
+                self.counter_v = self.v_start
+            else:
+                self.counter_v = self.counter_v + 1
+        else:
+            self.counter_h = self.counter_h + 1
+
+        self.x_pos = x_pos
+        self.y_pos = y_pos
+        self.capture = capture
+        self.rgb_d = rgb_d
+
+    def frame_clocked(self):
+        """Clock the model until the next frame was output completely"""
+        g = self.geometry
+
+        assert self.counter_v < 0, 'must start in the vertical blanking'
+
+        frame = np.zeros((g.height, g.width), dtype=np.uint8)
+
+        while True:
+            self.clock()
+
+            if 0 <= self.out_h < g.width and 0 <= self.out_v < g.height:
+                frame[self.out_v, self.out_h] = self.rgb_d
+
+            if self.out_h == g.width - 1 and self.out_v == g.height - 1:
+                return frame
+
+    def compile_line(self, words):
+        """Generate a function that executes the shader for one line
+
+        Only an instruction after a branch can be skipped, the
+        instructions are executed in a circle across pixels.
+        """
+        key = tuple(words)
+
+        if key in self.lines:
+            return self.lines[key]
+
+        conditions = {OP_IFEQ: '==', OP_IFNE: '!=', OP_IFGE: '>=', OP_IFLT: '<'}
+
+        lines = [
+            f'def line(state, y_pos, time, user, out):',
+            f'    r0, r1, r2, r3, rgb, skip = state',
+            f'    for x_pos in range({self.geometry.width // self.num_instr}):',
+        ]
+
+        for index, word in enumerate(words):
+            opcode, ra, rb, imm = decode(word)
+
+            if opcode in conditions:
+                statement = f'skip = not (r{ra} {conditions[opcode]} r0)'
+            else:
+                statement = {
+                    OP_SETRGB:  f'rgb = r{ra}',
+                    OP_SETR:    f'rgb = rgb & 0b001111 | (r{ra} & 0x3) << 4',
+                    OP_SETG:    f'rgb = rgb & 0b110011 | (r{ra} & 0x3) << 2',
+                    OP_SETB:    f'rgb = rgb & 0b111100 | r{ra} & 0x3',
+                    OP_GETX:    f'r{ra} = x_pos',
+                    OP_GETY:    f'r{ra} = y_pos',
+                    OP_GETTIME: f'r{ra} = time',
+                    OP_GETUSER: f'r{ra} = user',
+                    OP_DOUBLE:  f'r{ra} = r{ra} << 1 & 0x3F',
+                    OP_HALF:    f'r{ra} = r{ra} >> 1',
+                    OP_CLEAR:   f'r{ra} = 0',
+                    OP_SINE:    f'r{ra} = SINE_LUT32[r0 & 0x1F]',
+                    OP_AND:     f'r{ra} = r{ra} & r{rb}',
+                    OP_OR:      f'r{ra} = r{ra} | r{rb}',
+                    OP_NOT:     f'r{ra} = ~r{rb} & 0x3F',
+                    OP_XOR:     f'r{ra} = r{ra} ^ r{rb}',
+                    OP_MOV:     f'r{ra} = r{rb}',
+                    OP_ADD:     f'r{ra} = r{ra} + r{rb} & 0x3F',
+                    OP_SHIFTL:  f'r{ra} = r{ra} << r{rb} & 0x3F',
+                    OP_SHIFTR:  f'r{ra} = r{ra} >> r{rb}',
+                    OP_LDI:     f'r0 = {imm}',
+                }[opcode]
+
+            lines.append(f'        # {OPCODES[opcode]}')
+
+            # The previous instruction, across the pixel boundary
+            if decode(words[index - 1])[0] in conditions:
+                lines.append(f'        if skip:')
+                lines.append(f'            skip = False')
+                lines.append(f'        else:')
+                lines.append(f'            {statement}')
+            else:
+                lines.append(f'        {statement}')
+
+        lines.append(f'        out[x_pos] = rgb')
+        lines.append(f'    state[:] = [r0, r1, r2, r3, rgb, skip]')
+
+        namespace = {'SINE_LUT32': SINE_LUT + SINE_LUT[::-1]}
+        exec('\n'.join(lines) + '\n', namespace)
+
+        self.lines[key] = namespace['line']
+
+        return self.lines[key]
+
+    def frame(self):
+        """Output the next frame, same as frame_clocked() but faster"""
+        g = self.geometry
+        n = self.num_instr
+
+        assert self.counter_v < 0, 'must start in the vertical blanking'
+
+        # Each pixel shifts the memory by num_instr, so every pixel
+        # starts with the same instruction
+        line = self.compile_line(self.instructions())
+
+        state = self.regs + [self.rgb, self.skip]
+        rows = np.zeros((g.height, g.width // n), dtype=np.uint8)
+        out = bytearray(g.width // n)
+
+        for y in range(g.height):
+            y_pos = (self.y_pos + (self.y_subpos + y) // n) & self.y_mask
+            line(state, y_pos, self.time, self.user, out)
+            rows[y] = np.frombuffer(out, dtype=np.uint8)
+
+        self.regs = state[0:4]
+        self.rgb = state[4]
+        self.skip = state[5]
+
+        # State after the last line, same as after clocking the frame
+        self.y_subpos = (self.y_subpos + g.height) % n
+        self.x_subpos = 0
+        self.x_pos = 0
+        self.y_pos = 0
+        self.capture = False
+        self.rgb_d = self.rgb
+        self.hsync_o = 1
+        self.vsync_o = 1
+        self.counter_h = self.h_start
+        self.counter_v = self.v_start
+        self.out_h = g.width - 1
+        self.out_v = g.height - 1
+        self.next_time()
+
+        return np.repeat(rows, n, axis=1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Render frames as the hardware does')
+    parser.add_argument('-i', '--input', help='.bit or .shader file to load', type=str, required=True)
+    parser.add_argument('--image', help='save the frames as images', type=str, required=True)
+    parser.add_argument('-f', '--frames', help='number of frames after reset', default=1, type=int)
+    parser.add_argument('-u', '--user', help='value of the user register', default=42, type=int)
+    parser.add_argument('--clocked', help='clock the model cycle by cycle', action='store_true')
+    parser.add_argument('-g', '--geometry', help='timing of the design', choices=GEOMETRIES, default='vga')
+
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    model = TinyShaderTop(GEOMETRIES[args.geometry])
+    model.load(Program.from_file(args.input))
+    model.set_user(args.user)
+
+    for index in range(args.frames):
+        if args.clocked:
+            frame = model.frame_clocked()
+        else:
+            frame = model.frame()
+
+        img = Image.fromarray(expand_rrggbb(frame))
+
+        if args.frames == 1:
+            img.save(args.image)
+        else:
+            img.save(f'{os.path.splitext(args.image)[0]}_{index:02d}.png')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import os
+import time
+import select
+import struct
+import argparse
+
+# Framed binary protocol between the host and the board, over the USB serial REPL channel
+#
+#   frame    sync 0xA5, type u8, seq u8, length u8, payload, crc8
+#   crc8     polynomial 0x07 over type, seq, length and payload
+#
+# Requests, each answered with a response of type 0x80 | type and the same seq:
+#
+#   PING      empty
+#   SHADER    num_instr bytes, response has the upload latency as u32 in us
+#   USER      one byte
+#   PLAYLIST  flags u8 (CLEAR, PLAY, LOOP), then entries of (duration u16 in ms, num_instr bytes)
+#   STOP      stop the playlist
+#   EXIT      return to the text menu
+#
+# The response payload starts with a status byte. Requests can be pipelined,
+# the board handles them in order.
+
+SYNC = 0xA5
+
+PING = 0x01
+SHADER = 0x02
+USER = 0x03
+PLAYLIST = 0x04
+STOP = 0x05
+EXIT = 0x06
+
+RESPONSE = 0x80
+
+# Playlist flags
+CLEAR = 0x01
+PLAY = 0x02
+LOOP = 0x04
+
+# Response status
+OK = 0
+BAD_CRC = 1
+BAD_LENGTH = 2
+BAD_TYPE = 3
+
+STATUS = {OK: 'ok', BAD_CRC: 'bad crc', BAD_LENGTH: 'bad length', BAD_TYPE: 'unknown type'}
+
+MAX_PAYLOAD = 255
+ENTRY = '<H'
+
+def crc8(data, crc=0):
+    for byte in data:
+        crc ^= byte
+        for i in range(8):
+            crc = (crc << 1 ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+    return crc
+
+def encode(frame_type, seq, payload=b''):
+    """Encode a frame"""
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f'Payload longer than {MAX_PAYLOAD} bytes')
+
+    body = bytes([frame_type, seq, len(payload)]) + bytes(payload)
+    return bytes([SYNC]) + body + bytes([crc8(body)])
+
+def playlist_frames(entries, loop=False, num_instr=10):
+    """Payloads of PLAYLIST frames for a list of (duration in ms, words)
+
+    Long playlists are split, the first frame clears the
+    playlist and the last one starts playing.
+    """
+    entry_size = struct.calcsize(ENTRY) + num_instr
+    per_frame = (MAX_PAYLOAD - 1) // entry_size
+
+    chunks = [entries[i:i + per_frame] for i in range(0, len(entries), per_frame)] or [[]]
+    payloads = []
+
+    for index, chunk in enumerate(chunks):
+        flags = (CLEAR if index == 0 else 0) | (PLAY | (LOOP if loop else 0) if index == len(chunks) - 1 else 0)
+
+        payload = bytearray([flags])
+        for duration, words in chunk:
+            if len(words) != num_instr:
+                raise ValueError(f'Expected {num_instr} instructions, got {len(words)}')
+            payload += struct.pack(ENTRY, duration) + bytes(words)
+
+        payloads.append(bytes(payload))
+
+    return payloads
+
+class LinkError(Exception):
+    pass
+
+class ShaderLink:
+    """Host side of the protocol
+
+    Up to window requests are sent before waiting for a response.
+    A response with an error status raises LinkError.
+    """
+
+    def __init__(self, rx, tx, window=4, timeout=1.0):
+        self.rx = rx
+        self.tx = tx
+        self.window = window
+        self.timeout = timeout
+
+        self.seq = 0
+        self.pending = []
+        self.responses = {}
+
+    def _read(self, size):
+        data = b''
+
+        while len(data) < size:
+            readable, _, _ = select.select([self.rx], [], [], self.timeout)
+            if not readable:
+                raise LinkError('Timeout waiting for a response')
+
+            chunk = os.read(self.rx.fileno(), size - len(data))
+            if not chunk:
+                raise LinkError('Connection closed')
+            data += chunk
+
+        return data
+
+    def read_frame(self):
+        """Read the next frame, skips anything before the sync byte, e.g. the REPL echo"""
+        while self._read(1)[0] != SYNC:
+            pass
+
+        header = self._read(3)
+        payload = self._read(header[2])
+
+        if self._read(1)[0] != crc8(header + payload):
+            raise LinkError('Response with bad crc')
+
+        return header[0], header[1], payload
+
+    def send(self, frame_type, payload=b''):
+        """Send a request without waiting, returns its seq"""
+        if len(self.pending) >= self.window:
+            self.receive()
+
+        seq = self.seq
+        self.seq = (self.seq + 1) & 0xFF
+
+        self.tx.write(encode(frame_type, seq, payload))
+        self.tx.flush()
+        self.pending.append((seq, frame_type))
+
+        return seq
+
+    def receive(self):
+        """Wait for the response to the oldest pending request"""
+        seq, frame_type = self.pending.pop(0)
+
+        response_type, response_seq, payload = self.read_frame()
+
+        if response_seq != seq or response_type != RESPONSE | frame_type:
+            raise LinkError(f'Expected response {seq}, got {response_seq}')
+
+        if payload[0] != OK:
+            raise LinkError(f'Request {seq} failed: {STATUS.get(payload[0], payload[0])}')
+
+        self.responses[seq] = payload[1:]
+        return payload[1:]
+
+    def flush(self):
+        """Wait for all pending responses"""
+        while self.pending:
+            self.receive()
+
+    def request(self, frame_type, payload=b''):
+        """Send a request and wait for its response"""
+        seq = self.send(frame_type, payload)
+        self.flush()
+        return self.responses.pop(seq)
+
+    def connect(self, attempts=10):
+        """Ping until the board answers"""
+        for i in range(attempts):
+            try:
+                return self.request(PING)
+            except LinkError:
+                self.pending = []
+        raise LinkError('No answer from the board')
+
+    def shader(self, words):
+        """Upload a shader, returns the latency in us"""
+        return struct.unpack('<I', self.request(SHADER, bytes(words)))[0]
+
+    def user(self, value):
+        self.send(USER, bytes([value & 0x3F]))
+
+    def playlist(self, entries, loop=False):
+        for payload in playlist_frames(entries, loop):
+            self.send(PLAYLIST, payload)
+        self.flush()
+
+    def stop(self):
+        self.request(STOP)
+
+    def exit(self):
+        self.request(EXIT)
+
+def open_port(path):
+    """Open a serial port or pty in raw mode, returns (rx, tx)"""
+    import tty
+
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+    tty.setraw(fd)
+
+    return os.fdopen(fd, 'rb', buffering=0), os.fdopen(os.dup(fd), 'wb', buffering=0)
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream shaders to the board')
+    parser.add_argument('port', help='serial port of the board, e.g. /dev/ttyACM0')
+    parser.add_argument('inputs', help='.bit or .shader files to upload', nargs='*')
+    parser.add_argument('-u', '--user', help='set the user register', type=int, required=False)
+    parser.add_argument('-p', '--playlist', help='play the inputs as a playlist', action='store_true')
+    parser.add_argument('-d', '--duration', help='duration of each playlist entry in ms', default=5000, type=int)
+    parser.add_argument('--loop', help='loop the playlist', action='store_true')
+    parser.add_argument('--stop', help='stop the playlist', action='store_true')
+    parser.add_argument('--start', help='start the link from the text menu', action='store_true')
+    parser.add_argument('--exit', help='return to the text menu afterwards', action='store_true')
+    parser.add_argument('-w', '--window', help='number of requests in flight', default=4, type=int)
+
+    args = parser.parse_args()
+
+    from assembler import Program
+
+    rx, tx = open_port(args.port)
+    link = ShaderLink(rx, tx, window=args.window)
+
+    if args.start:
+        tx.write(b'link\r\n')
+
+    link.connect()
+
+    programs = [(os.path.basename(path), Program.from_file(path).words) for path in args.inputs]
+
+    start = time.time()
+
+    if args.stop:
+        link.stop()
+
+    if args.playlist:
+        link.playlist([(args.duration, words) for name, words in programs], args.loop)
+    else:
+        # Pipelined, the responses are collected afterwards
+        uploads = [(name, link.send(SHADER, bytes(words))) for name, words in programs]
+        link.flush()
+
+        for name, seq in uploads:
+            print(f'{name}: {struct.unpack("<I", link.responses.pop(seq))[0]} us')
+
+    if args.user is not None:
+        link.user(args.user)
+
+    link.flush()
+
+    print(f'{len(programs)} shaders in {(time.time() - start) * 1000:.1f} ms')
+
+    if args.exit:
+        link.exit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import re
+import struct
+import argparse
+
+# Pack layout, all values little endian:
+#
+#   header   magic 'TSPK', version u8, num_instr u8, count u16
+#   index    count x (name 16 bytes, zero padded, offset u32)
+#   programs count x num_instr bytes, offsets from the start of the pack
+
+MAGIC = b'TSPK'
+VERSION = 1
+
+HEADER = '<4sBBH'
+ENTRY = '<16sI'
+
+HEADER_SIZE = struct.calcsize(HEADER)
+ENTRY_SIZE = struct.calcsize(ENTRY)
+
+NAME_SIZE = 16
+
+def pack(programs, num_instr=10):
+    """Pack a list of (name, words) into a shader pack"""
+    header = struct.pack(HEADER, MAGIC, VERSION, num_instr, len(programs))
+
+    index = bytearray()
+    data = bytearray()
+
+    offset = HEADER_SIZE + ENTRY_SIZE * len(programs)
+
+    for name, words in programs:
+        name = name.encode()
+
+        if len(name) > NAME_SIZE:
+            raise ValueError(f'Name longer than {NAME_SIZE} bytes: {name}')
+
+        if len(words) != num_instr:
+            raise ValueError(f'Expected {num_instr} instructions, got {len(words)}')
+
+        index += struct.pack(ENTRY, name, offset + len(data))
+        data += bytes(words)
+
+    return header + index + data
+
+class ShaderPack:
+    """Read a shader pack, programs are returned as memoryview slices of the pack"""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+
+        magic, version, self.num_instr, count = struct.unpack_from(HEADER, self.data, 0)
+
+        if magic != MAGIC:
+            raise ValueError('Not a shader pack')
+
+        if version != VERSION:
+            raise ValueError(f'Unsupported shader pack version {version}')
+
+        self.offsets = {}
+        self.names = []
+
+        for i in range(count):
+            name, offset = struct.unpack_from(ENTRY, self.data, HEADER_SIZE + ENTRY_SIZE * i)
+            name = name.rstrip(b'\0').decode()
+
+            self.names.append(name)
+            self.offsets[name] = offset
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.offsets
+
+    def __getitem__(self, key):
+        """Get a program by name or by index"""
+        if isinstance(key, int):
+            key = self.names[key]
+
+        offset = self.offsets[key]
+        return self.data[offset:offset + self.num_instr]
+
+    def __iter__(self):
+        for name in self.names:
+            yield name, self[name]
+
+def natural_key(path):
+    """Sort test2 before test10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+def pack_files(paths, output):
+    """Pack .bit or .shader files, in natural order of their names"""
+    from assembler import Program
+
+    programs = []
+
+    for path in sorted(paths, key=natural_key):
+        name = os.path.splitext(os.path.basename(path))[0]
+        programs.append((name, Program.from_file(path).words))
+
+    with open(output, 'wb') as f:
+        f.write(pack(programs))
+
+def main():
+    parser = argparse.ArgumentParser(description='Create or list shader packs')
+    parser.add_argument('inputs', help='.bit or .shader files to pack', nargs='*')
+    parser.add_argument('-o', '--output', help='shader pack to write', type=str, required=False)
+    parser.add_argument('-l', '--list', help='list the contents of a shader pack', type=str, required=False)
+
+    args = parser.parse_args()
+
+    if args.list:
+        shader_pack = ShaderPack.from_file(args.list)
+
+        for name, words in shader_pack:
+            print(f'{name:16} {bytes(words).hex()}')
+
+    if args.output:
+        pack_files(args.inputs, args.output)
+
+if __name__ == "__main__":
+    main()
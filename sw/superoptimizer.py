@@ -0,0 +1,363 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from assembler import (Program, NUM_INSTR, NOP_WORD, DECODE_TABLE, decode, disassemble,
+    input_dependencies, simulate_array, step_array)
+
+# Number of random (x, y, time, user) samples a candidate is checked against first
+NUM_SAMPLES = 64
+
+# Immediates tried besides the ones of the original shader
+IMMEDIATES = [0, 1, 2, 4, 8, 16, 32, 63]
+
+# Instructions that never write an output can not end a program
+OUTPUTS = ('SETRGB', 'SETR', 'SETG', 'SETB')
+
+# Prefix states to remember per search, before the set is cleared
+MAX_SEEN = 1 << 20
+
+def register_masks(word):
+    """Bit masks of the registers an instruction reads and writes"""
+    name, fmt, ra, rb, imm = DECODE_TABLE[word]
+
+    if word == NOP_WORD:
+        return 0, 0
+
+    if name in ('SETRGB', 'SETR', 'SETG', 'SETB', 'DOUBLE', 'HALF'):
+        reads = 1 << ra
+    elif name.startswith('IF'):
+        reads = 1 << ra | 1
+    elif name == 'SINE':
+        reads = 1
+    elif name in ('AND', 'OR', 'XOR', 'ADD', 'SHIFTL', 'SHIFTR'):
+        reads = 1 << ra | 1 << rb
+    elif name in ('NOT', 'MOV'):
+        reads = 1 << rb
+    else:
+        reads = 0
+
+    if name in ('SETRGB', 'SETR', 'SETG', 'SETB') or name.startswith('IF'):
+        writes = 0
+    elif name == 'LDI':
+        writes = 1
+    else:
+        writes = 1 << ra
+
+    return reads, writes
+
+REGISTER_MASKS = [register_masks(word) for word in range(256)]
+
+def is_branch(word):
+    return DECODE_TABLE[word][0].startswith('IF')
+
+# Color channels written by the output instructions, as bit masks of (r, g, b)
+CHANNEL_MASKS = {'SETRGB': 0b111, 'SETR': 0b100, 'SETG': 0b010, 'SETB': 0b001}
+
+def state_dependency(words):
+    """Check that the colors only depend on the inputs
+
+    The emulator clears the registers and the color for each pixel,
+    the hardware does not. A program that reads a register before it
+    is written for sure, that does not write all color channels for
+    sure, or that ends with a branch, depends on the previous pixel
+    on the hardware and is not safe to replace. Returns the reason,
+    None if the program is stateless.
+    """
+    written = 0
+    channels = 0
+
+    for index, word in enumerate(words):
+        reads, writes = REGISTER_MASKS[word]
+
+        if reads & ~written:
+            return 'Reads registers before writing them, the result depends on the hardware state'
+
+        # A write after a branch may be skipped
+        if index == 0 or not is_branch(words[index - 1]):
+            written |= writes
+            channels |= CHANNEL_MASKS.get(DECODE_TABLE[word][0], 0)
+
+    if is_branch(words[-1]):
+        return 'Ends with a branch, the next pixel would start skipped'
+
+    if channels != 0b111:
+        missing = [name for name, mask in (('red', 0b100), ('green', 0b010), ('blue', 0b001)) if not channels & mask]
+        return f'Does not write {" and ".join(missing)} outside of a branch, the color of the previous pixel remains'
+
+    return None
+
+def stateless(words):
+    return state_dependency(words) is None
+
+def effective_words(program):
+    """Instruction words of the program without nops"""
+    return [word for word in program.words if word != NOP_WORD]
+
+def alphabet(program, all_immediates=False):
+    """Instruction words worth trying for a shorter version of the program
+
+    Words that are nops or duplicate other words are left out,
+    e.g. AND R1 R1 or ADD R1 R1 (same as DOUBLE R1). Only the
+    inputs the program reads are considered, and only a few
+    immediates unless all_immediates is set.
+    """
+    inputs = input_dependencies(program)
+
+    immediates = set(IMMEDIATES)
+    for word in program.words:
+        name, fmt, ra, rb, imm = DECODE_TABLE[word]
+        if name == 'LDI':
+            immediates.add(imm)
+
+    words = []
+
+    for word in range(256):
+        name, fmt, ra, rb, imm = DECODE_TABLE[word]
+
+        if name in ('GETX', 'GETY', 'GETTIME', 'GETUSER') and name[3:] not in inputs:
+            continue
+
+        # IF R0 compares R0 with itself
+        if name.startswith('IF') and ra == 0:
+            continue
+
+        if name in ('AND', 'OR', 'MOV', 'XOR', 'ADD') and ra == rb:
+            continue
+
+        if name == 'LDI' and not all_immediates and imm not in immediates:
+            continue
+
+        words.append(word)
+
+    return words
+
+def samples(num_samples, seed=0):
+    """Random inputs, plus all zeros and all ones"""
+    rng = np.random.default_rng(seed)
+
+    values = rng.integers(0, 64, size=(4, num_samples), dtype=np.uint8)
+    values[:, 0] = 0
+    values[:, 1] = 63
+
+    return values
+
+def initial_state(shape):
+    return (
+        [np.zeros(shape, dtype=np.uint8) for i in range(4)],
+        [np.zeros(shape, dtype=np.uint8) for i in range(3)],
+        np.zeros(shape, dtype=bool)
+    )
+
+def rrggbb(rgb):
+    return rgb[2] << 4 | rgb[1] << 2 | rgb[0]
+
+def state_key(state):
+    register, rgb, skip = state
+    return hash(b''.join(array.tobytes() for array in register + rgb) + skip.tobytes())
+
+def equivalent(a, b):
+    """Check that two programs give the same color for all 2^24 inputs
+
+    Inputs that neither program reads are left at zero, the
+    dependency analysis guarantees they do not matter.
+    """
+    inputs = input_dependencies(a) | input_dependencies(b)
+
+    x_pos = np.arange(64) if 'X' in inputs else np.zeros(1)
+    y_pos = np.arange(64)[:, np.newaxis] if 'Y' in inputs else np.zeros((1, 1))
+    user = np.arange(64)[:, np.newaxis, np.newaxis] if 'USER' in inputs else np.zeros((1, 1, 1))
+
+    # One time step at a time to bound the memory
+    for t in range(64 if 'TIME' in inputs else 1):
+        if not np.array_equal(rrggbb(simulate_array(a, x_pos, y_pos, t, user)),
+                              rrggbb(simulate_array(b, x_pos, y_pos, t, user))):
+            return False
+
+    return True
+
+def search(words, first, length, deadline, all_immediates=False, exhaustive=False):
+    """Search all programs of the given length that start with first
+
+    Candidates are rejected on random samples first, a candidate that
+    matches all samples is then checked exhaustively. Prefixes that
+    reach the same state on the samples are only searched once, which
+    may prune the only equivalent program, unless exhaustive is set.
+    Returns the words of an equivalent program, None if none was
+    found or 'timeout'.
+    """
+    program = Program(words)
+
+    x_pos, y_pos, cur_time, user = samples(NUM_SAMPLES)
+    expected = rrggbb(simulate_array(program, x_pos, y_pos, cur_time, user))
+
+    candidates = alphabet(program, all_immediates)
+    last = [word for word in candidates if DECODE_TABLE[word][0] in OUTPUTS]
+
+    # Lowest depth at which a state was seen, the state is only known on the samples
+    seen = {}
+
+    nodes = 0
+
+    def finish(state, prefix, words):
+        """Try each of the words as the last instruction"""
+        for word in words:
+            if not stateless(prefix + [word]):
+                continue
+
+            rgb = step_array(state, decode(word), x_pos, y_pos, cur_time, user)[1]
+
+            if np.array_equal(rrggbb(rgb), expected):
+                candidate = Program(prefix + [word] + [NOP_WORD] * (NUM_INSTR - length))
+                if equivalent(program, candidate):
+                    return prefix + [word]
+
+        return None
+
+    def dfs(state, prefix, written):
+        nonlocal nodes, seen
+
+        nodes += 1
+        if nodes % 1024 == 0 and time.time() > deadline:
+            raise TimeoutError
+
+        # Only an output instruction can end the program
+        if len(prefix) == length - 1:
+            return finish(state, prefix, last)
+
+        for word in candidates:
+            reads, writes = REGISTER_MASKS[word]
+
+            # Only read registers that are written for sure
+            if reads & ~written:
+                continue
+
+            next_state = step_array(state, decode(word), x_pos, y_pos, cur_time, user)
+
+            if is_branch(prefix[-1]):
+                writes = 0
+
+            # The same state was already searched with as many instructions left
+            if not exhaustive:
+                key = (state_key(next_state), written | writes)
+                if seen.get(key, length) <= len(prefix):
+                    continue
+
+                if len(seen) > MAX_SEEN:
+                    seen = {}
+                seen[key] = len(prefix)
+
+            result = dfs(next_state, prefix + [word], written | writes)
+            if result:
+                return result
+
+        return None
+
+    if length == 1:
+        return finish(initial_state(x_pos.shape), [], [first])
+
+    if REGISTER_MASKS[first][0]:
+        return None
+
+    state = step_array(initial_state(x_pos.shape), decode(first), x_pos, y_pos, cur_time, user)
+
+    try:
+        return dfs(state, [first], REGISTER_MASKS[first][1])
+    except TimeoutError:
+        return 'timeout'
+
+def superoptimize(program, budget=60, jobs=None, max_length=None, all_immediates=False, exhaustive=False, verbose=False):
+    """Find the shortest program equivalent to the given one
+
+    Programs of increasing length are searched in parallel, split
+    by their first instruction. Only stateless programs are
+    considered. Returns the words of a shorter program, or None
+    if none was found within the budget. Only an exhaustive search
+    shows that there is no shorter program with the alphabet.
+    """
+    words = list(program.words)
+    length = len(effective_words(program))
+
+    reason = state_dependency(words)
+    if reason:
+        if verbose:
+            print(reason)
+        return None
+
+    if max_length is not None:
+        length = min(length, max_length + 1)
+
+    deadline = time.time() + budget
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for candidate_length in range(1, length):
+
+            first = alphabet(program, all_immediates)
+            if candidate_length == 1:
+                first = [word for word in first if DECODE_TABLE[word][0] in OUTPUTS]
+
+            futures = [executor.submit(search, words, word, candidate_length, deadline, all_immediates, exhaustive) for word in first]
+            results = [future.result() for future in futures]
+
+            found = [result for result in results if result and result != 'timeout']
+
+            if found:
+                return found[0]
+
+            if 'timeout' in results:
+                if verbose:
+                    print(f'Time budget exceeded at length {candidate_length}')
+                return None
+
+            # Prefixes are only pruned from three instructions on
+            if verbose and (exhaustive or candidate_length < 3):
+                print(f'No equivalent program with {candidate_length} instructions')
+            elif verbose:
+                print(f'No equivalent program with {candidate_length} instructions found, prefixes were pruned on samples')
+
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Search for shorter equivalent shaders')
+    parser.add_argument('inputs', help='.shader or .bit files to optimize', nargs='+')
+    parser.add_argument('-o', '--output', help='directory for the optimized shaders', type=str, required=False)
+    parser.add_argument('-b', '--budget', help='time budget per shader in seconds', default=60, type=float)
+    parser.add_argument('-j', '--jobs', help='number of worker processes', type=int, required=False)
+    parser.add_argument('-l', '--max-length', help='longest program to search', type=int, required=False)
+    parser.add_argument('--all-immediates', help='try all 64 immediates instead of a few', action='store_true')
+    parser.add_argument('--exhaustive', help='do not prune prefixes with the same state on the samples', action='store_true')
+    parser.add_argument('-v', '--verbose', help='verbose output', action='store_true')
+
+    args = parser.parse_args()
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    for path in args.inputs:
+        program = Program.from_file(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+
+        if args.verbose:
+            print(f'{name}: {len(effective_words(program))} instructions')
+
+        start = time.time()
+        result = superoptimize(program, args.budget, args.jobs, args.max_length, args.all_immediates, args.exhaustive, args.verbose)
+        elapsed = time.time() - start
+
+        if not result:
+            print(f'{name}: no shorter program found ({elapsed:.1f} s)')
+            continue
+
+        print(f'{name}: {len(effective_words(program))} -> {len(result)} instructions ({elapsed:.1f} s)')
+        print(disassemble(result), end='')
+
+        if args.output:
+            with open(os.path.join(args.output, f'{name}.shader'), 'w') as f:
+                f.write(f'# Superoptimized version of {os.path.basename(path)}\n')
+                f.write(disassemble(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: © 2024 Leo Moser <leomoser99@gmail.com>
+# SPDX-License-Identifier: Apache-2.0
+
+"""Run the cocotb tests in parallel, one simulator process per shard
+
+Each shard gets its own directory below runs/ with its own sim_build
+and results.xml. The results are merged into results.xml. The simulator
+runs in the shard directory, the Makefile passes the default shader
+of the memory as an absolute path.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import importlib
+import subprocess
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def discover_tests(module='test'):
+    """Names of all cocotb tests of the module, including generated ones"""
+    sys.path.insert(0, TEST_DIR)
+    test_module = importlib.import_module(module)
+
+    return [name for name, obj in vars(test_module).items() if getattr(obj, 'im_test', False) and not getattr(obj, 'skip', False)]
+
+def run_shard(shard_dir, tests, make_args):
+    """Run the tests of one shard in its own directory, returns the path of its results.xml"""
+    os.makedirs(shard_dir, exist_ok=True)
+
+    results = os.path.join(shard_dir, 'results.xml')
+    if os.path.exists(results):
+        os.remove(results)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = TEST_DIR + os.pathsep + env.get('PYTHONPATH', '')
+
+    # PWD is used by the Makefile to find the sources
+    command = ['make', '-f', os.path.join(TEST_DIR, 'Makefile'), f'PWD={TEST_DIR}', f'TESTCASE={",".join(tests)}'] + make_args
+
+    with open(os.path.join(shard_dir, 'sim.log'), 'w') as log:
+        subprocess.run(command, cwd=shard_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    return results
+
+def merge_results(shards, output):
+    """Merge the results.xml of all shards, a shard without results counts as failed"""
+    testsuites = ET.Element('testsuites', name='results')
+    testsuite = ET.SubElement(testsuites, 'testsuite', name='all', package='all')
+
+    for tests, results in shards:
+        if os.path.exists(results):
+            for testcase in ET.parse(results).getroot().iter('testcase'):
+                testsuite.append(testcase)
+        else:
+            for test in tests:
+                testcase = ET.SubElement(testsuite, 'testcase', name=test, classname='test')
+                ET.SubElement(testcase, 'failure', message=f'No results, see {os.path.dirname(results)}/sim.log')
+
+    ET.ElementTree(testsuites).write(output, encoding='UTF-8', xml_declaration=True)
+
+    return testsuite
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the cocotb tests in parallel')
+    parser.add_argument('-j', '--jobs', help='number of simulator processes', default=os.cpu_count(), type=int)
+    parser.add_argument('-s', '--shards', help='number of shards, default is one test per shard', type=int, required=False)
+    parser.add_argument('-t', '--tests', help='only run these tests', nargs='+', required=False)
+    parser.add_argument('-o', '--output', help='merged results', default=os.path.join(TEST_DIR, 'results.xml'), type=str)
+    parser.add_argument('--runs', help='directory for the shards', default=os.path.join(TEST_DIR, 'runs'), type=str)
+    parser.add_argument('--gates', help='run the gate level simulation', action='store_true')
+    parser.add_argument('--small', help='run the RTL simulation with the reduced geometry', action='store_true')
+    parser.add_argument('--keep', help='keep the directories of previous runs', action='store_true')
+
+    args = parser.parse_args()
+
+    make_args = []
+
+    # The Makefile exports GL_TEST, set it here too so that skipped tests are known
+    if args.gates:
+        make_args.append('GATES=yes')
+        os.environ['GL_TEST'] = '1'
+    elif args.small:
+        make_args.append('GEOMETRY=small')
+
+    tests = args.tests or discover_tests()
+
+    num_shards = min(args.shards or len(tests), len(tests))
+    shards = [tests[i::num_shards] for i in range(num_shards)]
+
+    if not args.keep and os.path.exists(args.runs):
+        shutil.rmtree(args.runs)
+
+    print(f'Running {len(tests)} tests in {num_shards} shards with {args.jobs} processes')
+
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(run_shard, os.path.join(args.runs, f'shard_{i:03d}'), shard, make_args) for i, shard in enumerate(shards)]
+        results = [future.result() for future in futures]
+
+    testsuite = merge_results(zip(shards, results), args.output)
+
+    failures = [testcase.get('name') for testcase in testsuite.iter('testcase') if testcase.find('failure') is not None]
+
+    print(f'{len(testsuite)} tests in {time.time() - start:.1f} s, {len(failures)} failed')
+
+    for name in failures:
+        print(f'FAIL {name}')
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
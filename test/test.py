@@ -2,33 +2,52 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import os
+import sys
+import time
 import random
-from PIL import Image, ImageChops
+import numpy as np
+from PIL import Image
 import cocotb
 from cocotb.clock import Clock
 from cocotb.triggers import ClockCycles
 from cocotb.triggers import Timer, RisingEdge, FallingEdge
 from cocotb.regression import TestFactory
+from cocotb.utils import get_sim_time
 
 from cocotbext.spi import SpiBus, SpiConfig, SpiMaster
 
+# Paths relative to this file, tests may run in another directory
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+SW_DIR = os.path.join(TEST_DIR, '../sw')
+
+sys.path.append(SW_DIR)
+from shaderpack import ShaderPack
+from assembler import OPCODES, DECODE_TABLE, NOP_WORD, disassemble, disassemble_word
+from hwmodel import GEOMETRIES
+
 # Tiny Shader Settings
 NUM_INSTR = 10
 
-# VGA Parameters
-WIDTH    = 640
-HEIGHT   = 480
+# VGA Parameters, GEOMETRY=small selects the reduced geometry of the RTL simulation
+GEOMETRY = GEOMETRIES[os.environ.get('GEOMETRY', 'vga')]
+
+WIDTH    = GEOMETRY.width
+HEIGHT   = GEOMETRY.height
 
-HFRONT   = 16
-HSYNC    = 96
-HBACK    = 48
+HFRONT   = GEOMETRY.hfront
+HSYNC    = GEOMETRY.hsync
+HBACK    = GEOMETRY.hback
 
-VFRONT   = 10
-VSYNC    = 2
-VBACK    = 33
+VFRONT   = GEOMETRY.vfront
+VSYNC    = GEOMETRY.vsync
+VBACK    = GEOMETRY.vback
 
 POLARITY = 0
 
+# Cycles per line and clock period of the tests
+LINE_CYCLES = HFRONT + HSYNC + HBACK + WIDTH
+CLOCK_NS = 10
+
 # Reset coroutine
 async def reset_dut(rst_ni, duration_ns):
     rst_ni.value = 0
@@ -44,8 +63,15 @@ async def sync_frame(dut):
         await RisingEdge(dut.vsync)
         await RisingEdge(dut.hsync)
 
+def check_pixel(expected, x, y, actual):
+    """Fail on the first pixel that differs from the golden rrggbb frame at the native resolution"""
+    if expected is not None and actual != expected[y // NUM_INSTR, x // NUM_INSTR]:
+        raise AssertionError(f'Pixel ({x}, {y}), block ({x // NUM_INSTR}, {y // NUM_INSTR}): '
+                             f'expected {expected[y // NUM_INSTR, x // NUM_INSTR]:06b} got {actual:06b}')
+
 # Draw the current frame and return it
-async def draw_frame(dut):
+# If the expected frame is given, fail on the first differing pixel
+async def draw_frame(dut, expected=None):
     screen_x = -HBACK
     screen_y = -VBACK
 
@@ -75,6 +101,7 @@ async def draw_frame(dut):
             #print(dut.timing_hor.counter.value.integer)
             #print(dut.timing_ver.counter.value.integer)
             pixels[screen_x, screen_y] = (r, g, b)
+            check_pixel(expected, screen_x, screen_y, dut.rrggbb.value.integer)
         
         # Received hsync
         if (dut.hsync.value == POLARITY):
@@ -101,6 +128,118 @@ async def draw_frame(dut):
         else:
             screen_x += 1
 
+# RGB888 color of each rrggbb value, same as draw_frame
+COLORS = [bytes([[0, 127, 128, 255][c >> s & 0x3] for s in (4, 2, 0)]) for c in range(64)]
+
+# Draw the current frame, sampling once per shader pixel
+async def draw_frame_fast(dut, expected=None):
+    """Same result as draw_frame, but only one sample per block of NUM_INSTR pixels
+
+    The color only changes once per block, so instead of awaiting
+    every clock, each block is sampled in the middle of its first
+    clock cycle by waiting a fixed time after the start of the line.
+    If the expected frame is given, fails on the first differing block.
+    """
+    sync_edge = FallingEdge if POLARITY else RisingEdge
+
+    # Preallocated frame buffer, filled line by line
+    frame = bytearray(WIDTH * HEIGHT * 3)
+
+    # Skip the back porch
+    for i in range(VBACK):
+        await sync_edge(dut.hsync)
+
+    for y in range(HEIGHT):
+        start = get_sim_time('ns')
+        row = y * WIDTH * 3
+
+        for x in range(0, WIDTH, NUM_INSTR):
+            # Pixel x is output with the (x + HBACK)th rising edge after hsync
+            await Timer(start + (x + HBACK) * CLOCK_NS + CLOCK_NS // 2 - get_sim_time('ns'), units='ns')
+
+            rrggbb = dut.rrggbb.value.integer
+            check_pixel(expected, x, y, rrggbb)
+            frame[row + x*3 : row + (x+NUM_INSTR)*3] = COLORS[rrggbb] * NUM_INSTR
+
+        if y < HEIGHT - 1:
+            await sync_edge(dut.hsync)
+
+    # Same as draw_frame, return at the start of the next frame
+    await sync_edge(dut.vsync)
+    await sync_edge(dut.hsync)
+
+    return Image.frombytes('RGB', (WIDTH, HEIGHT), bytes(frame))
+
+def deposit(signal, value):
+    """Deposit a value, negative values in two's complement"""
+    signal.value = value & ((1 << len(signal)) - 1)
+
+# Draw the current frame, skipping the blanking
+async def draw_frame_skip(dut, expected=None):
+    """Same result as draw_frame_fast, but the blanking is skipped
+
+    The timing counters are deposited to jump over the horizontal
+    and vertical blanking, in which only the sync signals change.
+    At the end of each line, counter_h jumps to the last cycle before
+    the shader executes for the first pixel. At the start of the frame,
+    counter_v jumps to the first line. hsync and vsync are not valid
+    while skipping. Returns in the blanking after the frame.
+    """
+    top = dut.tt_um_tiny_shader_mole99_inst.tiny_shader_top_inst
+    counter_h = top.timing_hor.counter
+    counter_v = top.timing_ver.counter
+
+    # Preallocated frame buffer, filled line by line
+    frame = bytearray(WIDTH * HEIGHT * 3)
+
+    # The shader state is only consistent in the vertical blanking
+    if counter_v.value.signed_integer >= 0:
+        await (FallingEdge if POLARITY else RisingEdge)(dut.vsync)
+
+    # Middle of a clock cycle
+    await RisingEdge(dut.clk)
+    await Timer(CLOCK_NS // 2, units='ns')
+
+    deposit(counter_v, 0)
+    deposit(counter_h, -NUM_INSTR - 1)
+
+    for y in range(HEIGHT):
+        row = y * WIDTH * 3
+
+        # Pixel x is output in the cycle with counter_h == x + 1
+        await Timer((NUM_INSTR + 2) * CLOCK_NS, units='ns')
+
+        for x in range(0, WIDTH, NUM_INSTR):
+            if x:
+                await Timer(NUM_INSTR * CLOCK_NS, units='ns')
+
+            rrggbb = dut.rrggbb.value.integer
+            check_pixel(expected, x, y, rrggbb)
+            frame[row + x*3 : row + (x+NUM_INSTR)*3] = COLORS[rrggbb] * NUM_INSTR
+
+        # Cycle after the last one of the line, counter_h has wrapped
+        await Timer((NUM_INSTR - 1) * CLOCK_NS, units='ns')
+
+        if y < HEIGHT - 1:
+            deposit(counter_h, -NUM_INSTR - 1)
+
+    return Image.frombytes('RGB', (WIDTH, HEIGHT), bytes(frame))
+
+# Skip the blanking, unless DRAW_FRAME is set to full or fast
+# In the gate level simulation the counters can not be deposited
+CAPTURE_FRAME = {
+    'full': draw_frame,
+    'fast': draw_frame_fast,
+    'skip': draw_frame_skip,
+}
+
+capture_frame = CAPTURE_FRAME[os.environ.get('DRAW_FRAME', 'fast' if os.environ.get('GL_TEST', None) else 'skip')]
+
+async def start_frame(dut):
+    """Sync to the start of a frame, only needed with the full timing"""
+    if capture_frame != draw_frame_skip:
+        await sync_frame(dut)
+
 @cocotb.test()
 async def test_vga_default(dut):
     """Draw two frames with the default shader"""
@@ -118,36 +257,158 @@ async def test_vga_default(dut):
     dut._log.info("Reset done")
     
     # Sync to start of frame
-    await sync_frame(dut)
+    await start_frame(dut)
     
+    # The default shader is test4, an unloaded memory draws X
+    expected = load_golden('test4', time=0)
+
     # Start thread to draw frame
-    task_draw_frame = await cocotb.start(draw_frame(dut))
+    task_draw_frame = await cocotb.start(capture_frame(dut, expected))
 
     image = await task_draw_frame.join()
     image.save(f"default.png")
+
+    compare_frame(dut, image, expected)
     
+    # cur_time is 1, TIME is cur_time >> 3
+    expected = load_golden('test4', time=0)
+
     # Start thread to draw frame
-    task_draw_frame = await cocotb.start(draw_frame(dut))
+    task_draw_frame = await cocotb.start(capture_frame(dut, expected))
 
     image = await task_draw_frame.join()
     image.save(f"default2.png")
 
+    compare_frame(dut, image, expected)
+
     await ClockCycles(dut.clk, 10)
 
+@cocotb.test()
+async def test_vga_timing(dut):
+    """Check the sync signals, always with the full timing"""
+
+    # Start the clock
+    c = Clock(dut.clk, CLOCK_NS, 'ns')
+    await cocotb.start(c.start())
+
+    # Assign default values
+    dut.ena.value = 1
+    dut.mode.value = 0 # cmd mode
+
+    # Reset
+    await reset_dut(dut.rst_n, 50)
+    dut._log.info("Reset done")
+
+    pulse_start = RisingEdge if POLARITY else FallingEdge
+    pulse_end = FallingEdge if POLARITY else RisingEdge
+
+    # Start of the back porch of the first frame
+    await pulse_end(dut.vsync)
+    frame_start = get_sim_time('ns')
+    await pulse_end(dut.hsync)
+    line_start = get_sim_time('ns')
+
+    # Horizontal sync
+    await pulse_start(dut.hsync)
+    hsync_start = get_sim_time('ns')
+    await pulse_end(dut.hsync)
+    hsync_end = get_sim_time('ns')
+
+    assert hsync_end - hsync_start == HSYNC * CLOCK_NS
+    assert hsync_end - line_start == LINE_CYCLES * CLOCK_NS
+
+    # Vertical sync
+    await pulse_start(dut.vsync)
+    vsync_start = get_sim_time('ns')
+    await pulse_end(dut.vsync)
+    vsync_end = get_sim_time('ns')
+
+    assert vsync_end - vsync_start == VSYNC * LINE_CYCLES * CLOCK_NS
+    assert vsync_end - frame_start == (HEIGHT + VFRONT + VSYNC + VBACK) * LINE_CYCLES * CLOCK_NS
+
+    await ClockCycles(dut.clk, 10)
+
+# All shaders, generated by the assembler (make bits in sw/)
+shader_pack = ShaderPack.from_file(os.path.join(TEST_DIR, '../bring-up/tt_um_tiny_shader_mole99/shaders.pack'))
+
 def load_shader(shader_name):
-    """Load a shader from a binary text file"""
-    shader = []
-    
-    with open(f'../sw/binary/{shader_name}.bit') as f:
-        for line in f.readlines():
-            if '//' in line:
-                line = line.split('//')[0]
-            line = line.replace('_', '')
-            line.strip()
-            if line:
-                shader.append(int(line, 2))
-    
-    return shader
+    """Load a shader from the shader pack"""
+    return list(shader_pack[shader_name])
+
+# Deposit the shaders into the memory, unless SHADER_LOAD is set to spi
+# In the gate level simulation the memory can not be accessed
+SHADER_LOAD = os.environ.get('SHADER_LOAD', 'spi' if os.environ.get('GL_TEST', None) else 'backdoor')
+
+async def write_shader(dut, shader, spi_master):
+    """Write a shader into the shader memory
+
+    The backdoor deposits the words directly into the memory. This is only
+    valid in the vertical blanking, where the memory does not shift and
+    memory[0] holds the first instruction. The SPI receiver is covered by
+    test_spi_shader and test_spi_random.
+    """
+    if SHADER_LOAD == 'spi':
+        await spi_master.write(shader, burst=True)
+        return
+
+    wrapper = dut.tt_um_tiny_shader_mole99_inst
+    top = wrapper.tiny_shader_top_inst
+    memory = top.shader_memory_inst.memory
+
+    # The reset is released on a falling edge, while it is active
+    # the memory is loaded with the default shader on every rising edge
+    while True:
+        await FallingEdge(dut.clk)
+        await Timer(1, units='ns')
+        if str(wrapper.rst_n_sync.value) == '1':
+            break
+
+    assert top.timing_ver.counter.value.signed_integer < 0, 'The backdoor only works in the vertical blanking'
+
+    for i, word in enumerate(shader):
+        memory[i].value = word
+
+    # The words must persist over a full clock cycle
+    await ClockCycles(dut.clk, 2)
+    await FallingEdge(dut.clk)
+
+    for i, word in enumerate(shader):
+        assert memory[i].value == word, f'memory[{i}] is {memory[i].value}, expected {word:08b}'
+
+# Golden frames at the native resolution, generated by the assembler (make bits in sw/)
+golden = np.load(os.path.join(SW_DIR, 'images/golden.npz'))
+
+def load_golden(shader_name, time=0):
+    """Golden rrggbb frame of a shader, shaders that never read TIME have a single frame
+
+    The shader only sees the block position, a smaller geometry
+    shows the top left corner of the full frame.
+    """
+    frames = golden[shader_name]
+    return frames[time % len(frames)][:HEIGHT // NUM_INSTR, :WIDTH // NUM_INSTR]
+
+def compare_frame(dut, image, expected):
+    """Compare a captured frame with a golden frame at the native resolution
+
+    Each block of NUM_INSTR x NUM_INSTR pixels must have a single color.
+    On a mismatch, a heatmap of the blocks is logged: '.' matches,
+    'X' differs and '?' is not uniform.
+    """
+    frame = np.asarray(image.convert('RGB')) >> 6
+    rrggbb = frame[..., 0] << 4 | frame[..., 1] << 2 | frame[..., 2]
+
+    blocks = rrggbb.reshape(HEIGHT // NUM_INSTR, NUM_INSTR, WIDTH // NUM_INSTR, NUM_INSTR)
+
+    uniform = blocks.min(axis=(1, 3)) == blocks.max(axis=(1, 3))
+    mismatch = blocks[:, 0, :, 0] != expected
+
+    if uniform.all() and not mismatch.any():
+        return
+
+    heatmap = np.where(uniform, np.where(mismatch, 'X', '.'), '?')
+    dut._log.error('Blocks that differ from the golden frame:\n' + '\n'.join(''.join(row) for row in heatmap))
+
+    assert False, f'{np.count_nonzero(mismatch)} blocks differ, {np.count_nonzero(~uniform)} blocks are not uniform'
 
 # TestFactory
 async def test_vga_load(dut, shader_name='test7'):
@@ -185,34 +446,43 @@ async def test_vga_load(dut, shader_name='test7'):
     # Get shader
     shader = load_shader(shader_name)
     assert(len(shader) == NUM_INSTR)
+    
+    dut._log.info(f'{shader_name}: {", ".join(disassemble_word(word) for word in shader)}')
 
-    # Send new shader instructions
-    await spi_master.write(shader, burst=True)
+    # Write the shader, right after reset we are in the vertical blanking
+    await write_shader(dut, shader, spi_master)
     
     # Sync to start of frame
-    await sync_frame(dut)
+    await start_frame(dut)
     
-    # Start thread to draw frame
-    task_draw_frame = await cocotb.start(draw_frame(dut))
+    # First frame after reset, time is 0
+    expected = load_golden(shader_name, time=0)
+    
+    # Start thread to draw frame, stops at the first wrong pixel
+    task_draw_frame = await cocotb.start(capture_frame(dut, expected))
 
     image = await task_draw_frame.join()
     image.save(f"{shader_name}.png")
     
-    gold = Image.open(f'../sw/images/{shader_name}.png')
-    
-    # Scale with factor
-    gold = gold.resize((gold.width*NUM_INSTR, gold.height*NUM_INSTR), Image.NEAREST)
-    
-    gold.save(f"{shader_name}_gold.png")
-    
-    # Check that images are the same
-    diff = ImageChops.difference(image.convert('RGB'), gold.convert('RGB'))
-    assert(not diff.getbbox())
+    compare_frame(dut, image, expected)
 
     await ClockCycles(dut.clk, 10)
 
+def regression_shaders():
+    """Shaders of the frame tests
+
+    regression.txt is the smallest set with the instruction coverage
+    of all shaders, selected by sw/coverage.py. SHADERS=all runs every
+    shader of the pack.
+    """
+    if os.environ.get('SHADERS', None) == 'all':
+        return shader_pack.names
+
+    with open(os.path.join(TEST_DIR, 'regression.txt')) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
 tf = TestFactory(test_function=test_vga_load)
-tf.add_option(name='shader_name', optionlist=['test1', 'test2', 'test3', 'test4', 'test5', 'test6', 'test7'])
+tf.add_option(name='shader_name', optionlist=regression_shaders())
 tf.generate_tests()
 
 @cocotb.test(skip=os.environ.get('GL_TEST', None) != None)
@@ -365,3 +635,158 @@ async def test_spi_random(dut):
     await spi_master.write([data])
     assert(dut.tt_um_tiny_shader_mole99_inst.tiny_shader_top_inst.user.value == data & 0x3F)
 
+# Fuzzing
+
+# Instruction words grouped by mnemonic, so that each mnemonic is equally likely
+FUZZ_WORDS = [[word for word in range(256) if DECODE_TABLE[word][0] == name] for name in OPCODES]
+
+def random_program(rng):
+    return [rng.choice(rng.choice(FUZZ_WORDS)) for i in range(NUM_INSTR)]
+
+async def fuzz_frame(dut, spi_master, model, shader, user, samples):
+    """Load a shader and a user value in the vertical blanking and compare
+    the sampled pixels of the next frame with the model
+
+    Must be called before the rising edge of vsync. The model has to
+    be in the same state as the design. Returns the mismatches
+    as (x, y, expected, actual).
+    """
+
+    # The back porch follows the vsync pulse
+    await RisingEdge(dut.vsync)
+    await RisingEdge(dut.hsync)
+
+    # Start of the first line of the back porch
+    anchor = get_sim_time('ns')
+
+    dut.mode.value = 0 # cmd mode
+    await spi_master.write([user])
+
+    dut.mode.value = 1 # data mode
+    await spi_master.write(shader, burst=True)
+
+    assert get_sim_time('ns') < anchor + VBACK * LINE_CYCLES * CLOCK_NS, 'Loading the shader took longer than the back porch'
+
+    model.set_user(user)
+    model.load(shader)
+    expected = model.frame()
+
+    mismatches = []
+
+    for x, y in samples:
+        # The pixel is output with the (x + HBACK)th rising edge after hsync,
+        # sample it in the middle of the following clock cycle
+        await Timer(anchor + ((VBACK + y) * LINE_CYCLES + x + HBACK) * CLOCK_NS + CLOCK_NS // 2 - get_sim_time('ns'), units='ns')
+
+        actual = dut.rrggbb.value.integer
+        if actual != expected[y, x]:
+            mismatches.append((x, y, expected[y, x], actual))
+
+    return mismatches
+
+async def fuzz_reproduce(dut, spi_master, model, shader, user, samples):
+    """Run the shader right after reset, returns the mismatches"""
+    await reset_dut(dut.rst_n, 50)
+    model.reset()
+
+    return await fuzz_frame(dut, spi_master, model, shader, user, samples)
+
+@cocotb.test(skip=os.environ.get('FUZZ', None) == None)
+async def test_fuzz(dut):
+    """Stream random shaders into one simulation and compare sampled pixels with the model
+
+    FUZZ is the number of shaders, FUZZ_SAMPLES the number of pixels compared
+    per frame and FUZZ_SEED the random seed. A failing shader is minimized by
+    replacing instructions with NOPs and saved to fuzz/.
+    """
+    from hwmodel import TinyShaderTop
+
+    num_programs = int(os.environ['FUZZ'])
+    num_samples = int(os.environ.get('FUZZ_SAMPLES', 64))
+    seed = int(os.environ.get('FUZZ_SEED', random.randrange(1 << 32)))
+
+    dut._log.info(f'Fuzzing {num_programs} shaders with seed {seed}')
+
+    rng = random.Random(seed)
+
+    # Start the clock
+    c = Clock(dut.clk, CLOCK_NS, 'ns')
+    await cocotb.start(c.start())
+
+    spi_bus = SpiBus.from_prefix(dut, "spi")
+
+    spi_config = SpiConfig(
+        word_width = 8,
+        sclk_freq  = 2e6,
+        cpol       = False,
+        cpha       = True,
+        msb_first  = True,
+        frame_spacing_ns = 500
+    )
+
+    spi_master = SpiMaster(spi_bus, spi_config)
+
+    # Assign default values
+    dut.ena.value = 1
+    dut.mode.value = 0 # cmd mode
+
+    # Reset, the model runs in lockstep from here on
+    await reset_dut(dut.rst_n, 50)
+    dut._log.info("Reset done")
+
+    model = TinyShaderTop(GEOMETRY)
+
+    start = time.time()
+
+    mismatches = []
+    index = -1
+
+    for index in range(num_programs):
+        shader = random_program(rng)
+        user = rng.randrange(64)
+
+        # Sorted by line, the pixels are visited in the order they are output
+        samples = sorted({(rng.randrange(WIDTH), rng.randrange(HEIGHT)) for i in range(num_samples)}, key=lambda p: (p[1], p[0]))
+
+        mismatches = await fuzz_frame(dut, spi_master, model, shader, user, samples)
+
+        if mismatches:
+            break
+
+    elapsed = time.time() - start
+    dut._log.info(f'{index + 1} shaders in {elapsed:.1f} s, {(index + 1) / max(elapsed, 1e-9):.2f} shaders/s')
+
+    if not mismatches:
+        return
+
+    x, y, expected, actual = mismatches[0]
+    dut._log.error(f'Frame {index}: {len(mismatches)} mismatches, first at ({x}, {y}) expected {expected:06b} got {actual:06b}')
+
+    # Include the failing pixels when reproducing
+    samples = sorted(set(samples) | {(x, y) for x, y, e, a in mismatches}, key=lambda p: (p[1], p[0]))
+
+    # Minimize from reset, if the failure does not depend on the previous shaders
+    header = f'# Fuzz seed {seed}, shader {index}, USER={user}\n'
+
+    if await fuzz_reproduce(dut, spi_master, model, shader, user, samples):
+        header += '# Fails in the first frame after reset\n'
+
+        for i in range(NUM_INSTR):
+            if shader[i] == NOP_WORD:
+                continue
+
+            candidate = shader[:i] + [NOP_WORD] + shader[i+1:]
+
+            if await fuzz_reproduce(dut, spi_master, model, candidate, user, samples):
+                shader = candidate
+    else:
+        header += f'# Only fails after {index} previous shaders, rerun with FUZZ_SEED={seed}\n'
+
+    os.makedirs('fuzz', exist_ok=True)
+    path = f'fuzz/fuzz_{seed}_{index}.shader'
+
+    with open(path, 'w') as f:
+        f.write(header)
+        f.write(disassemble(shader))
+
+    assert not mismatches, f'Mismatch between design and model, reproducer saved to {path}'